@@ -1,20 +1,53 @@
-import requests
+import asyncio
+import hashlib
+import httpx
 import json
-from config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL
+from async_database import AsyncDatabase
+from background_loop import BackgroundEventLoop
+from cache import TTLCache
+from config import (
+    AI_CACHE_SIZE, AI_CACHE_TTL, AI_MAX_CONNECTIONS, AI_REQUEST_TIMEOUT,
+    DEEPSEEK_API_KEY, DEEPSEEK_API_URL
+)
 from database import Database
 
+class AIRequestError(Exception):
+    """رد غير ناجح من DeepSeek"""
+    
+    def __init__(self, status_code):
+        super().__init__(f"DeepSeek returned {status_code}")
+        self.status_code = status_code
+
 class AIAssistant:
+    """مساعد DeepSeek بعميل HTTP غير متزامن واحد (keep-alive) على حلقة asyncio مستقلة
+
+    الردود مخزنة مؤقتاً حسب hash الرسائل (السياق + رسالة المستخدم)، والطلبات
+    المتطابقة المتزامنة تنتظر طلباً واحداً بدلاً من إرسال كل منها.
+    """
+    
     def __init__(self):
         self.api_key = DEEPSEEK_API_KEY
         self.api_url = DEEPSEEK_API_URL
-        self.db = Database()
+        self.db = AsyncDatabase(Database())
+        self.event_loop = BackgroundEventLoop('ai-assistant')
+        self.cache = TTLCache(maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL)
+        self._client = None
+        self._inflight = {}
     
     def query(self, user_message, user_id):
         """إرسال استفسار للذكاء الاصطناعي مع بيانات المستخدم"""
-        
+        return self.event_loop.run(self._query(user_message, user_id))
+    
+    async def query_async(self, user_message, user_id):
+        """نسخة async من query يمكن انتظارها من أي حلقة asyncio"""
+        return await asyncio.wrap_future(self.event_loop.submit(self._query(user_message, user_id)))
+    
+    async def _query(self, user_message, user_id):
         # جلب معلومات المستخدم ومعاملاته
-        user = self.db.get_user(user_id)
-        transactions = self.db.get_active_transactions(user_id=user_id)
+        user, transactions = await asyncio.gather(
+            self.db.get_user(user_id),
+            self.db.get_active_transactions(user_id=user_id)
+        )
         
         # بناء السياق للذكاء الاصطناعي
         context = self._build_context(user, transactions)
@@ -39,30 +72,9 @@ class AIAssistant:
         
         # إرسال الطلب للـ API
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": "deepseek-chat",
-                "messages": messages,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content']
-            else:
-                return f"عذراً، حدث خطأ في الاتصال بالذكاء الاصطناعي. الكود: {response.status_code}"
-        
+            return await self._complete(messages, temperature=0.7)
+        except AIRequestError as e:
+            return f"عذراً، حدث خطأ في الاتصال بالذكاء الاصطناعي. الكود: {e.status_code}"
         except Exception as e:
             return f"عذراً، حدث خطأ: {str(e)}"
     
@@ -81,7 +93,15 @@ class AIAssistant:
     
     def add_transaction_via_chat(self, user_message, user_id):
         """إضافة معاملة عبر المحادثة الطبيعية"""
-        
+        return self.event_loop.run(self._add_transaction_via_chat(user_message, user_id))
+    
+    async def add_transaction_via_chat_async(self, user_message, user_id):
+        """نسخة async من add_transaction_via_chat"""
+        return await asyncio.wrap_future(
+            self.event_loop.submit(self._add_transaction_via_chat(user_message, user_id))
+        )
+    
+    async def _add_transaction_via_chat(self, user_message, user_id):
         messages = [
             {
                 "role": "system",
@@ -101,30 +121,65 @@ class AIAssistant:
         ]
         
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": "deepseek-chat",
-                "messages": messages,
-                "temperature": 0.3
-            }
-            
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                extracted_data = result['choices'][0]['message']['content']
-                return json.loads(extracted_data)
-            else:
-                return None
-        
+            extracted_data = await self._complete(messages, temperature=0.3)
+            return json.loads(extracted_data)
         except Exception as e:
             return None
+    
+    # ==================== عميل DeepSeek ====================
+    
+    def _get_client(self):
+        """عميل httpx واحد يعيد استخدام اتصالات TCP/TLS بين الطلبات"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=AI_REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=AI_MAX_CONNECTIONS,
+                    max_keepalive_connections=AI_MAX_CONNECTIONS
+                ),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._client
+    
+    async def _complete(self, messages, temperature):
+        """نص الرد: من الذاكرة المؤقتة، أو بانتظار طلب مطابق قيد التنفيذ، أو بطلب جديد"""
+        key = hashlib.sha256(
+            json.dumps([temperature, messages], ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()
+        
+        content = self.cache.get(key)
+        if content is not None:
+            return content
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, messages, temperature))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: إلغاء أحد المنتظرين لا يلغي الطلب على البقية
+        return await asyncio.shield(task)
+    
+    async def _fetch(self, key, messages, temperature):
+        payload = {
+            "model": "deepseek-chat",
+            "messages": messages,
+            "temperature": temperature
+        }
+        response = await self._get_client().post(self.api_url, json=payload)
+        if response.status_code != 200:
+            raise AIRequestError(response.status_code)
+        
+        content = response.json()['choices'][0]['message']['content']
+        self.cache.set(key, content)
+        return content
+    
+    def close(self):
+        """إغلاق عميل HTTP وقاعدة البيانات وإيقاف الحلقة"""
+        if self._client is not None:
+            self.event_loop.run(self._client.aclose())
+            self._client = None
+        self.event_loop.run(self.db.close())
+        self.event_loop.stop()
@@ -1,15 +1,22 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from database_supabase import Database
-from datetime import datetime
+from datetime import date, datetime
+import csv
+import io
+import json
 import os
+import re
 
 # ==================== استيراد AI Agent ====================
 from ai_agent import AIAgent
+from config import WEBHOOK_BATCH_MAX
+from metrics import instrument_flask
 
 api = Flask(__name__)
+instrument_flask(api, 'api')
 api.secret_key = os.environ.get('API_SECRET_KEY', 'your-secret-key-here')
 db = Database()
-ai_agent = AIAgent()  # ✅ إضافة AI Agent
+ai_agent = AIAgent(db)  # ✅ إضافة AI Agent
 
 # Middleware للمصادقة
 def require_api_key(f):
@@ -27,15 +34,66 @@ def require_api_key(f):
 @api.route('/api/v1/transactions', methods=['GET'])
 @require_api_key
 def get_transactions():
-    """جلب جميع المعاملات"""
+    """جلب المعاملات (صفحة بعد صفحة عبر limit و cursor)"""
     user_id = request.args.get('user_id', type=int)
-    transactions = db.get_active_transactions(user_id=user_id)
+    try:
+        transactions, next_cursor = db.get_active_transactions_page(
+            user_id=user_id,
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    
     return jsonify({
         'success': True,
         'count': len(transactions),
-        'data': transactions
+        'data': transactions,
+        'next_cursor': next_cursor
     })
 
+@api.route('/api/v1/transactions/export', methods=['GET'])
+@require_api_key
+def export_transactions():
+    """تصدير جميع المعاملات كبث NDJSON أو CSV بذاكرة ثابتة"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'success': False, 'error': 'Unsupported format'}), 400
+    
+    chunks = db.iter_transaction_chunks(
+        include_inactive=request.args.get('include_inactive', '0') in ('1', 'true')
+    )
+    
+    def generate_ndjson():
+        for rows in chunks:
+            yield ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows)
+    
+    def generate_csv():
+        fieldnames = None
+        for rows in chunks:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fieldnames or list(rows[0].keys()))
+            if fieldnames is None:
+                fieldnames = writer.fieldnames
+                writer.writeheader()
+            writer.writerows(
+                {key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+                 for key, value in row.items()}
+                for row in rows
+            )
+            yield buffer.getvalue()
+    
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=transactions.{export_format}'}
+    )
+
 @api.route('/api/v1/transactions/<int:transaction_id>', methods=['GET'])
 @require_api_key
 def get_transaction(transaction_id):
@@ -132,58 +190,144 @@ def create_user():
 @require_api_key
 def get_stats():
     """إحصائيات النظام"""
-    transactions = db.get_active_transactions()
-    users = db.get_all_users()
-    
-    today = datetime.now().date()
-    critical = 0
-    warning = 0
-    
-    for trans in transactions:
-        try:
-            end_date = datetime.strptime(trans['end_date'], '%Y-%m-%d').date()
-            days_left = (end_date - today).days
-            if days_left <= 3:
-                critical += 1
-            elif days_left <= 7:
-                warning += 1
-        except:
-            pass
+    # العد والتصنيف يتمان في قاعدة البيانات دون نقل المعاملات
+    buckets = db.get_urgency_buckets()
     
     return jsonify({
         'success': True,
         'data': {
-            'total_transactions': len(transactions),
-            'total_users': len(users),
-            'critical_transactions': critical,
-            'warning_transactions': warning,
-            'safe_transactions': len(transactions) - critical - warning
+            'total_transactions': buckets['total'],
+            'total_users': db.get_statistics().get('total_users', 0),
+            'critical_transactions': buckets['critical'],
+            'warning_transactions': buckets['warning'],
+            'safe_transactions': buckets['safe']
         }
     })
 
 # ==================== Webhooks ====================
 
+_INTEGER_STRING = re.compile(r'[+-]?[0-9]+')
+
+def _required_int(data, key):
+    """عدد صحيح أو نص أرقام عشرية ("5") كما كان يقبله int() سابقاً - وليس bool أو عدداً عشرياً يُقتطع بصمت"""
+    value = data[key]
+    if isinstance(value, str) and _INTEGER_STRING.fullmatch(value.strip()):
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"'{key}' must be an integer")
+    return value
+
+def webhook_item(data, idempotency_key=None):
+    """تحويل عنصر webhook إلى معاملات add_transactions_bulk (KeyError/ValueError للبيانات غير الصالحة)"""
+    if not isinstance(data, dict):
+        raise ValueError('transaction must be an object')
+    
+    metadata = data.get('metadata', {})
+    if metadata is None:
+        metadata = {}
+    if not isinstance(metadata, dict):
+        raise ValueError("'metadata' must be an object")
+    
+    title = data['title']
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("'title' must be a non-empty string")
+    
+    end_date = data['end_date']
+    if not isinstance(end_date, str):
+        raise ValueError("'end_date' must be an ISO date string")
+    
+    description = data.get('description') or ''
+    if not isinstance(description, str):
+        raise ValueError("'description' must be a string")
+    
+    priority = data.get('priority', 'normal')
+    if priority not in ('normal', 'high', 'critical'):
+        raise ValueError("'priority' must be one of normal, high, critical")
+    
+    key = data.get('idempotency_key') or idempotency_key
+    if key is not None and not isinstance(key, (str, int)):
+        raise ValueError("'idempotency_key' must be a string")
+    
+    return {
+        'transaction_type_id': _required_int(data, 'type'),
+        'user_id': _required_int(data, 'user_id'),
+        'title': title,
+        'description': description,
+        'priority': priority,
+        'data': metadata,
+        'end_date': date.fromisoformat(end_date),
+        'idempotency_key': str(key) if key is not None else None
+    }
+
 @api.route('/api/v1/webhook/transaction', methods=['POST'])
 @require_api_key
 def webhook_transaction():
-    """استقبال webhooks من أنظمة خارجية"""
+    """استقبال webhooks من أنظمة خارجية (Idempotency-Key يمنع التكرار عند إعادة المحاولة)"""
     data = request.json
     
+    try:
+        item = webhook_item(data, request.headers.get('Idempotency-Key'))
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Invalid transaction: {e}'}), 400
+    
     # معالجة البيانات وإضافة المعاملة
-    transaction_id = db.add_transaction(
-        transaction_type_id=data['type'],
-        user_id=data['user_id'],
-        title=data['title'],
-        data=data.get('metadata', {}),
-        end_date=data['end_date']
-    )
+    results = db.add_transactions_bulk([item])
     
-    if transaction_id:
+    if results and results[0]['transaction_id'] is not None:
         # إرسال تنبيه تليجرام (اختياري)
-        return jsonify({'success': True, 'transaction_id': transaction_id}), 201
+        result = results[0]
+        return jsonify({
+            'success': True,
+            'transaction_id': result['transaction_id'],
+            'duplicate': not result['created']
+        }), 201 if result['created'] else 200
     
     return jsonify({'success': False}), 500
 
+@api.route('/api/v1/webhook/transactions/batch', methods=['POST'])
+@require_api_key
+def webhook_transactions_batch():
+    """استقبال دفعة معاملات: مصفوفة JSON أو NDJSON (معاملة في كل سطر)"""
+    body = request.get_data(as_text=True)
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl') or not body.lstrip().startswith('['):
+            payload = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            payload = json.loads(body)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
+    
+    if not payload:
+        return jsonify({'success': False, 'error': 'Empty batch'}), 400
+    if len(payload) > WEBHOOK_BATCH_MAX:
+        return jsonify({'success': False, 'error': f'Batch too large (max {WEBHOOK_BATCH_MAX})'}), 413
+    
+    # التحقق من كل العناصر قبل الكتابة: الدفعة تُحفظ كاملة أو لا شيء
+    items = []
+    for index, data in enumerate(payload):
+        try:
+            items.append(webhook_item(data))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': f'Invalid transaction at index {index}: {e}'}), 400
+    
+    results = db.add_transactions_bulk(items)
+    if results is None:
+        return jsonify({'success': False}), 500
+    
+    created = sum(1 for result in results if result['created'])
+    failed = sum(1 for result in results if result['transaction_id'] is None)
+    if failed:
+        status = 207
+    else:
+        status = 201 if created else 200
+    return jsonify({
+        'success': not failed,
+        'created': created,
+        'duplicates': len(results) - created - failed,
+        'failed': failed,
+        'results': results
+    }), status
+
 # ==================== AI Agent Endpoints ✨ ====================
 
 @api.route('/api/v1/ai/analyze', methods=['GET'])
@@ -217,9 +361,24 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'lookup_cache': db.cache_stats()
     })
 
+@api.route('/api/v1/debug/queries', methods=['GET'])
+@require_api_key
+def query_profile():
+    """قوالب الاستعلامات الأبطأ من محلل الاستعلامات"""
+    limit = request.args.get('limit', 20, type=int)
+    order_by = request.args.get('order_by', 'total_ms')
+    if order_by not in ('total_ms', 'mean_ms', 'max_ms', 'count', 'slow_count'):
+        return jsonify({'success': False, 'error': 'Invalid order_by'}), 400
+    
+    queries = db.query_profile(limit=limit, order_by=order_by)
+    if queries is None:
+        return jsonify({'success': False, 'error': 'Query profiler disabled (QUERY_PROFILER_ENABLED)'}), 404
+    return jsonify({'success': True, 'queries': queries})
+
 @api.route('/api/v1/docs', methods=['GET'])
 def api_docs():
     """توثيق API"""
@@ -228,7 +387,8 @@ def api_docs():
         'base_url': '/api/v1',
         'authentication': 'API Key in X-API-Key header',
         'endpoints': {
-            'GET /transactions': 'جلب جميع المعاملات',
+            'GET /transactions': 'جلب المعاملات (?limit=&cursor= للصفحة التالية عبر next_cursor)',
+            'GET /transactions/export': 'تصدير جميع المعاملات (?format=ndjson|csv)',
             'GET /transactions/:id': 'جلب معاملة واحدة',
             'POST /transactions': 'إضافة معاملة',
             'PUT /transactions/:id': 'تحديث معاملة',
@@ -237,11 +397,13 @@ def api_docs():
             'GET /users/:id': 'جلب مستخدم',
             'POST /users': 'إضافة مستخدم',
             'GET /stats': 'الإحصائيات',
-            'POST /webhook/transaction': 'استقبال webhook',
+            'POST /webhook/transaction': 'استقبال webhook (ترويسة Idempotency-Key اختيارية)',
+            'POST /webhook/transactions/batch': 'استقبال دفعة معاملات (مصفوفة JSON أو NDJSON، idempotency_key لكل عنصر)',
             'GET /ai/analyze': '🤖 تحليل ذكي بواسطة AI',
             'GET /ai/schedule': '🤖 جدولة ذكية',
             'GET /ai/predict/:id': '🤖 توقع التأخيرات',
             'GET /health': 'فحص الصحة',
+            'GET /debug/queries': 'أبطأ قوالب الاستعلامات (?limit=&order_by=total_ms|mean_ms|max_ms|count|slow_count)',
             'GET /docs': 'التوثيق'
         }
     }
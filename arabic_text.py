@@ -0,0 +1,65 @@
+"""
+توحيد النص العربي للبحث: أشكال الألف والهمزة، التاء المربوطة، التشكيل والتطويل
+نفس القواعد مطبقة في Python (لنص البحث) وفي دالة SQL (للفهرس) حتى يتطابق الطرفان
+"""
+
+# الحرف -> بديله الموحد
+LETTER_MAP = {
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    'ى': 'ي',
+    'ة': 'ه',
+}
+
+# التشكيل (U+064B - U+065F)، الألف الخنجرية (U+0670) والتطويل (U+0640) تُحذف
+REMOVED_CHARS = ''.join(chr(c) for c in range(0x064B, 0x0660)) + 'ٰ' + 'ـ'
+
+_TRANSLATION = str.maketrans(
+    ''.join(LETTER_MAP),
+    ''.join(LETTER_MAP.values()),
+    REMOVED_CHARS
+)
+
+
+def normalize_arabic(text):
+    """توحيد نص للبحث"""
+    if not text:
+        return ''
+    return text.translate(_TRANSLATION).lower()
+
+
+def escape_like(text):
+    """تهريب محارف LIKE الخاصة"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _sql_literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+# translate() في PostgreSQL يحذف المحارف التي ليس لها مقابل في الوسيط الثالث
+NORMALIZE_ARABIC_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION normalize_arabic(input TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT lower(translate(
+            coalesce(input, ''),
+            {_sql_literal(''.join(LETTER_MAP) + REMOVED_CHARS)},
+            {_sql_literal(''.join(LETTER_MAP.values()))}
+        ))
+    $$
+"""
+
+def search_document_sql(alias=None):
+    """تعبير SQL لمستند البحث في المعاملة: العنوان والوصف ومفاتيح وقيم data
+
+    يجب أن يطابق التعبير في الاستعلام تعبير الفهرس حتى يستخدمه المخطط
+    """
+    prefix = f"{alias}." if alias else ''
+    return (
+        f"normalize_arabic(coalesce({prefix}title, '') || ' ' || coalesce({prefix}description, '') "
+        f"|| ' ' || coalesce({prefix}data::text, ''))"
+    )
@@ -0,0 +1,66 @@
+import asyncio
+import functools
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DB_EXECUTOR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def _default_workers(database):
+    """عدد الـ Threads المناسب للخلفية: حجم المجمع، أو Thread واحد للاتصال المشترك"""
+    if getattr(database, 'pool_max', 0):
+        return database.pool_max
+    if getattr(database, 'performance_profile', False):
+        return DB_EXECUTOR_WORKERS
+    # الاتصال المشترك (SQLite الافتراضي أو PostgreSQL بدون مجمع) لا يحتمل الاستدعاء المتزامن
+    return 1
+
+
+class AsyncDatabase:
+    """واجهة async لـ Database (PostgreSQL أو SQLite) بنفس أسماء الدوال
+
+    كل استدعاء يُنفذ في ThreadPoolExecutor مخصص فلا تحجب استعلامات قاعدة البيانات
+    حلقة asyncio الخاصة بالبوت:
+
+        db = AsyncDatabase(Database())
+        user = await db.get_user(user_id)
+    """
+
+    def __init__(self, database, max_workers=None):
+        self.sync = database
+        self.max_workers = max_workers or _default_workers(database)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='async-db'
+        )
+
+    def __getattr__(self, name):
+        attribute = getattr(self.sync, name)
+        if not callable(attribute):
+            return attribute
+        # المولدات ومديرو السياق (iter_transaction_chunks، transaction) تُستخدم عبر self.sync
+        if inspect.isgeneratorfunction(attribute) or hasattr(attribute, '__wrapped__'):
+            raise AttributeError(f"'{name}' cannot be awaited; use AsyncDatabase.sync.{name}")
+
+        @functools.wraps(attribute)
+        async def call(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+
+        # حفظ الدالة حتى لا تُنشأ في كل استدعاء
+        setattr(self, name, call)
+        return call
+
+    async def run(self, func, *args, **kwargs):
+        """تنفيذ دالة متزامنة في Thread قاعدة البيانات"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def close(self):
+        """إغلاق قاعدة البيانات ثم الـ Threads"""
+        try:
+            await self.run(self.sync.close)
+        finally:
+            self._executor.shutdown(wait=False)
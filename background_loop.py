@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundEventLoop:
+    """حلقة asyncio طويلة العمر تعمل في Thread مستقل"""
+
+    def __init__(self, name='background-loop'):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """تشغيل الحلقة إن لم تكن تعمل"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self.loop
+
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(self.loop)
+                self.loop.call_soon(ready.set)
+                self.loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"🔁 Event loop '{self.name}' started")
+            return self.loop
+
+    def submit(self, coro):
+        """جدولة coroutine على الحلقة وإرجاع concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """تنفيذ coroutine على الحلقة وانتظار النتيجة من Thread آخر"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        """إيقاف الحلقة"""
+        with self._lock:
+            if not self._thread:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+            self.loop.close()
+            self._thread = None
+            logger.info(f"🛑 Event loop '{self.name}' stopped")
@@ -0,0 +1,18 @@
+"""
+أدوات عرض نتائج القياس (بدون اعتماديات) يستخدمها benchmark.py وbenchmark_suite.py وtest_api.py
+"""
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print(' | '.join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print('-+-'.join('-' * w for w in widths))
+    for row in rows:
+        print(' | '.join(str(c).ljust(w) for c, w in zip(row, widths)))
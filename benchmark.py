@@ -0,0 +1,425 @@
+"""
+قياس أداء استعلامات قاعدة البيانات
+قياسات PostgreSQL تعمل على قاعدة DATABASE_URL داخل schema مؤقت يُحذف بعد الانتهاء
+وقياس SQLite يعمل على ملف مؤقت
+
+الاستخدام:
+    python benchmark.py pending
+    python benchmark.py search
+    python benchmark.py sqlite
+"""
+
+import contextlib
+import os
+import sys
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+from arabic_text import NORMALIZE_ARABIC_FUNCTION_SQL, escape_like, normalize_arabic, search_document_sql
+from bench_report import percentile, print_table
+
+load_dotenv()
+
+BENCH_SCHEMA = 'bench_notifications'
+RUNS = 7
+
+# ==================== دوال مساعدة ====================
+
+def timed(cur, query, params=None, runs=RUNS):
+    """تنفيذ استعلام عدة مرات وإرجاع الوسيط بالملي ثانية"""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        cur.execute(query, params)
+        cur.fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def plan_summary(cur, query, params=None):
+    """أول عقدة مسح في خطة التنفيذ (Seq Scan / Index Scan ...)"""
+    cur.execute("EXPLAIN " + query, params)
+    for (line,) in cur.fetchall():
+        if 'Scan' in line:
+            return line.strip().lstrip('-> ').split('  ')[0]
+    return '-'
+
+
+# ==================== التنبيهات المعلقة ====================
+
+PENDING_OLD = """
+    SELECT n.*, t.title, t.end_date, t.priority, tt.name as type_name
+    FROM notifications n
+    JOIN transactions t ON n.transaction_id = t.transaction_id
+    JOIN transaction_types tt ON t.transaction_type_id = tt.id
+    WHERE n.sent = false
+    AND t.is_active = true
+    AND t.status = 'active'
+    AND (t.end_date - n.days_before) = CURRENT_DATE
+    ORDER BY n.created_at ASC
+"""
+
+PENDING_NEW = """
+    SELECT n.*, t.title, t.end_date, t.priority, tt.name as type_name
+    FROM notifications n
+    JOIN transactions t ON n.transaction_id = t.transaction_id
+    JOIN transaction_types tt ON t.transaction_type_id = tt.id
+    WHERE n.sent = false
+    AND n.fire_at = CURRENT_DATE
+    AND t.is_active = true
+    AND t.status = 'active'
+    ORDER BY n.created_at ASC
+"""
+
+
+def create_pending_schema(cur):
+    """إنشاء نسخة مصغرة من الجداول داخل schema القياس"""
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+    cur.execute("""
+        CREATE TABLE transaction_types (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+        INSERT INTO transaction_types VALUES (1, 'عقد عمل'), (2, 'إجازة موظف'), (3, 'ترخيص');
+
+        CREATE TABLE transactions (
+            transaction_id BIGSERIAL PRIMARY KEY,
+            transaction_type_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            end_date DATE NOT NULL,
+            priority TEXT DEFAULT 'normal',
+            status TEXT DEFAULT 'active',
+            is_active BOOLEAN DEFAULT true
+        );
+
+        CREATE TABLE notifications (
+            notification_id BIGSERIAL PRIMARY KEY,
+            transaction_id BIGINT NOT NULL,
+            days_before INTEGER NOT NULL,
+            recipients BIGINT[],
+            message TEXT,
+            sent BOOLEAN DEFAULT false,
+            fire_at DATE,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+
+        CREATE INDEX idx_notifications_pending_fire_at
+        ON notifications (fire_at)
+        WHERE sent = false;
+    """)
+
+
+def grow_pending_data(cur, target_notifications):
+    """إضافة معاملات (5 تنبيهات لكل معاملة) حتى الوصول للحجم المطلوب"""
+    cur.execute("SELECT COUNT(*) FROM transactions")
+    current = cur.fetchone()[0]
+    target = target_notifications // 5
+    if target <= current:
+        return
+
+    # تواريخ انتهاء موزعة على سنتين حول اليوم
+    cur.execute("""
+        INSERT INTO transactions (transaction_type_id, title, end_date)
+        SELECT 1 + (g %% 3), 'معاملة ' || g, CURRENT_DATE + ((random() * 730)::int - 365)
+        FROM generate_series(%s, %s) g
+    """, (current + 1, target))
+
+    # التنبيهات التي فات موعدها تكون مرسلة كما في الإنتاج
+    cur.execute("""
+        INSERT INTO notifications (transaction_id, days_before, recipients, sent, fire_at)
+        SELECT t.transaction_id, d, ARRAY[1001::bigint],
+               (t.end_date - d) < CURRENT_DATE, t.end_date - d
+        FROM transactions t
+        CROSS JOIN unnest(ARRAY[30, 15, 7, 3, 0]) d
+        WHERE t.transaction_id > %s
+    """, (current,))
+    cur.execute("ANALYZE transactions; ANALYZE notifications")
+
+
+def bench_pending(conn, sizes=(10_000, 100_000, 1_000_000, 3_000_000)):
+    """مقارنة الاستعلام القديم (تعبير على عمودين) بالجديد (fire_at + فهرس جزئي)"""
+    print("\n🔔 قياس get_pending_notifications")
+    rows = []
+    with conn.cursor() as cur:
+        create_pending_schema(cur)
+        conn.commit()
+        try:
+            for size in sizes:
+                grow_pending_data(cur, size)
+                conn.commit()
+                old_ms = timed(cur, PENDING_OLD)
+                new_ms = timed(cur, PENDING_NEW)
+                rows.append((
+                    f"{size:,}",
+                    f"{old_ms:.2f}",
+                    f"{new_ms:.2f}",
+                    plan_summary(cur, PENDING_NEW)
+                ))
+                print(f"  ✅ {size:,} تنبيه")
+        finally:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            conn.commit()
+
+    print()
+    print_table(['notifications', 'old (ms)', 'fire_at (ms)', 'plan'], rows)
+
+# ==================== البحث ====================
+
+SEARCH_USER_ID = 1
+
+SEARCH_ILIKE = """
+    SELECT t.*
+    FROM transactions t
+    WHERE t.user_id = %(user_id)s
+    AND t.is_active = true
+    AND (t.title ILIKE %(pattern)s OR t.description ILIKE %(pattern)s)
+    ORDER BY t.end_date ASC
+"""
+
+SEARCH_INDEXED = f"""
+    SELECT t.*, word_similarity(%(term)s, {search_document_sql('t')}) as rank
+    FROM transactions t
+    WHERE t.user_id = %(user_id)s
+    AND t.is_active = true
+    AND ({search_document_sql('t')} LIKE %(pattern)s OR %(term)s <%% {search_document_sql('t')})
+    ORDER BY rank DESC, t.end_date ASC
+"""
+
+SEARCH_TERMS = ['إجازة', 'مؤسسة', 'رخصه', 'الرياض']
+
+
+def create_search_schema(cur):
+    """جدول معاملات بعناوين عربية وdata بصيغة JSONB مع فهرس trigram"""
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    cur.execute(f"SET search_path TO {BENCH_SCHEMA}, public")
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    cur.execute(NORMALIZE_ARABIC_FUNCTION_SQL)
+    cur.execute("""
+        CREATE TABLE transactions (
+            transaction_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            data JSONB,
+            end_date DATE NOT NULL,
+            is_active BOOLEAN DEFAULT true
+        )
+    """)
+    cur.execute(f"""
+        CREATE INDEX idx_transactions_search_trgm
+        ON transactions USING gin ({search_document_sql()} gin_trgm_ops)
+    """)
+    cur.execute("""
+        CREATE INDEX idx_transactions_user_active
+        ON transactions (user_id, end_date, transaction_id)
+        WHERE is_active = true
+    """)
+
+
+def grow_search_data(cur, target):
+    """إضافة معاملات بنصوص عربية مشكولة وغير مشكولة؛ نصفها تقريباً للمستخدم المقاس"""
+    cur.execute("SELECT COUNT(*) FROM transactions")
+    current = cur.fetchone()[0]
+    if target <= current:
+        return
+
+    cur.execute("""
+        INSERT INTO transactions (user_id, title, description, data, end_date)
+        SELECT
+            CASE WHEN g %% 2 = 0 THEN %s ELSE 2 + (g %% 1000) END,
+            (ARRAY['إِجَازَة موظف', 'عقد عمل', 'رخصة بلدية', 'استمارة سيارة', 'جلسة قضائية'])[1 + g %% 5]
+                || ' رقم ' || g,
+            (ARRAY['مؤسسة النور', 'شركة الأمل', 'مكتب المحاماة'])[1 + g %% 3],
+            jsonb_build_object('المدينة', (ARRAY['الرياض', 'جدة', 'الدمام'])[1 + g %% 3], 'رقم', g),
+            CURRENT_DATE + (g %% 730)
+        FROM generate_series(%s, %s) g
+    """, (SEARCH_USER_ID, current + 1, target))
+    cur.execute("ANALYZE transactions")
+
+
+def bench_search(conn, sizes=(10_000, 100_000, 1_000_000)):
+    """مقارنة البحث بـ ILIKE (مسح كامل) بالبحث الموحد عبر فهرس trigram"""
+    print("\n🔎 قياس search_transactions")
+    rows = []
+    with conn.cursor() as cur:
+        create_search_schema(cur)
+        conn.commit()
+        try:
+            for size in sizes:
+                grow_search_data(cur, size)
+                conn.commit()
+                for term in SEARCH_TERMS:
+                    normalized = normalize_arabic(term)
+                    ilike_params = {'user_id': SEARCH_USER_ID, 'pattern': f"%{escape_like(term)}%"}
+                    indexed_params = {
+                        'user_id': SEARCH_USER_ID,
+                        'term': normalized,
+                        'pattern': f"%{escape_like(normalized)}%",
+                    }
+                    cur.execute(SEARCH_ILIKE, ilike_params)
+                    ilike_hits = cur.rowcount
+                    cur.execute(SEARCH_INDEXED, indexed_params)
+                    indexed_hits = cur.rowcount
+                    rows.append((
+                        f"{size:,}",
+                        term,
+                        f"{timed(cur, SEARCH_ILIKE, ilike_params):.2f}",
+                        f"{timed(cur, SEARCH_INDEXED, indexed_params):.2f}",
+                        f"{ilike_hits}/{indexed_hits}",
+                        plan_summary(cur, SEARCH_INDEXED, indexed_params)
+                    ))
+                print(f"  ✅ {size:,} معاملة")
+        finally:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            conn.commit()
+
+    print()
+    print_table(['transactions', 'term', 'ilike (ms)', 'indexed (ms)', 'hits ilike/indexed', 'plan'], rows)
+
+# ==================== SQLite: قراءة وكتابة متزامنة ====================
+
+SQLITE_READERS = 8
+SQLITE_WRITERS = 2
+SQLITE_DURATION = 5
+
+
+def seed_sqlite(db, transactions):
+    """معاملات نصفها نشط مع 5 تنبيهات لكل معاملة"""
+    db.add_user(1, '0500000000', 'مستخدم القياس')
+    db.cursor.executemany(
+        "INSERT INTO transactions (transaction_type_id, user_id, title, data, end_date, is_active) "
+        "VALUES (?, ?, ?, '{}', date('now', ? || ' days'), ?)",
+        [(1 + i % 5, 1, f"معاملة {i}", str(i % 730 - 365), i % 2) for i in range(transactions)]
+    )
+    db.cursor.execute(
+        "INSERT INTO notifications (transaction_id, days_before, recipients, sent) "
+        "SELECT t.transaction_id, d.days, '[1]', t.transaction_id % 3 = 0 FROM transactions t "
+        "CROSS JOIN (SELECT 30 AS days UNION ALL SELECT 15 UNION ALL SELECT 7 "
+        "UNION ALL SELECT 3 UNION ALL SELECT 0) d"
+    )
+    db.conn.commit()
+
+
+def run_sqlite_workload(db, duration=SQLITE_DURATION):
+    """قراء يستدعون get_active_transactions/get_pending_notifications وكتّاب يضيفون معاملات"""
+    # الاتصال والمؤشر المشتركان غير آمنين للاستخدام المتزامن (قد يتعطل العملية)، لذا تُسلسل العمليات
+    guard = contextlib.nullcontext() if db.performance_profile else threading.Lock()
+    stop = threading.Event()
+    results = {'read_ms': [], 'write_ms': [], 'errors': 0}
+    lock = threading.Lock()
+
+    def reader(index):
+        samples = []
+        errors = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with guard:
+                    if index % 2:
+                        db.get_active_transactions()
+                    else:
+                        db.get_pending_notifications()
+            except Exception:
+                errors += 1
+            samples.append((time.perf_counter() - started) * 1000)
+        with lock:
+            results['read_ms'].extend(samples)
+            results['errors'] += errors
+
+    def writer(index):
+        samples = []
+        errors = 0
+        n = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with guard:
+                    transaction_id = db.add_transaction(1, 1, f"كتابة {index}-{n}", {}, '2030-01-01')
+                if transaction_id is None:
+                    errors += 1
+            except Exception:
+                errors += 1
+            samples.append((time.perf_counter() - started) * 1000)
+            n += 1
+        with lock:
+            results['write_ms'].extend(samples)
+            results['errors'] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(SQLITE_READERS)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(SQLITE_WRITERS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def bench_sqlite(conn=None, sizes=(10_000, 100_000)):
+    """مقارنة الإعداد الافتراضي (اتصال مشترك) بملف تعريف الأداء تحت قراءة وكتابة متزامنة"""
+    from database import Database
+
+    print(f"\n🗄️ قياس SQLite ({SQLITE_READERS} قراء، {SQLITE_WRITERS} كتّاب، {SQLITE_DURATION} ثوانٍ)")
+    rows = []
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    try:
+        for size in sizes:
+            for profile in (False, True):
+                path = os.path.join(workdir, f"{size}_{int(profile)}.db")
+                db = Database(path, performance_profile=profile)
+                seed_sqlite(db, size)
+                results = run_sqlite_workload(db)
+                db.close()
+                reads, writes = results['read_ms'], results['write_ms']
+                rows.append((
+                    f"{size:,}",
+                    'performance' if profile else 'default',
+                    f"{len(reads) / SQLITE_DURATION:.0f}",
+                    f"{percentile(reads, 95):.2f}",
+                    f"{len(writes) / SQLITE_DURATION:.0f}",
+                    f"{percentile(writes, 95):.2f}",
+                    results['errors']
+                ))
+                print(f"  ✅ {size:,} معاملة ({'performance' if profile else 'default'})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print_table(['transactions', 'profile', 'reads/s', 'read p95 (ms)', 'writes/s', 'write p95 (ms)', 'errors'], rows)
+
+# ==================== تشغيل ====================
+
+BENCHMARKS = {
+    'pending': bench_pending,
+    'search': bench_search,
+    'sqlite': bench_sqlite,
+}
+
+# قياسات لا تحتاج اتصال PostgreSQL
+LOCAL_BENCHMARKS = {'sqlite'}
+
+
+def main(argv):
+    names = argv[1:] or list(BENCHMARKS)
+    conn = None
+    try:
+        for name in names:
+            if name not in LOCAL_BENCHMARKS and conn is None:
+                conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+            BENCHMARKS[name](conn)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,485 @@
+"""
+مجموعة قياس أداء المسارات الساخنة على بيانات اصطناعية بأحجام مختلفة
+تولد مستخدمين ومعاملات (عناوين عربية وتواريخ انتهاء واقعية) وتنبيهاتها، ثم تقيس
+دوال قاعدة البيانات ونقاط الإحصائيات وتحفظ النتائج بصيغة JSON للمقارنة بين التشغيلات
+
+الاستخدام:
+    python benchmark_suite.py run --backend sqlite --scales 10000 100000
+    python benchmark_suite.py run --backend postgres --scales 10000 100000 1000000
+    python benchmark_suite.py compare results/old.json results/new.json
+
+قياس postgres يستخدم DATABASE_URL (قاعدة محلية) داخل schema مؤقت يُحذف بعد الانتهاء
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+from dotenv import load_dotenv
+
+from bench_report import percentile, print_table
+
+load_dotenv()
+
+SUITE_SCHEMA = 'bench_suite'
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+DEFAULT_RUNS = 5
+CHUNK_SIZE = 10_000
+SEED = 42
+REMINDER_OFFSETS = [30, 15, 7, 3, 0]
+
+# ==================== مولد البيانات ====================
+
+FIRST_NAMES = ['أحمد', 'محمد', 'فاطمة', 'خالد', 'نورة', 'سعد', 'مريم', 'عبدالعزيز', 'هند', 'ماجد', 'ريم', 'عبدالله']
+FAMILY_NAMES = ['العلي', 'الأحمدي', 'القحطاني', 'المطيري', 'الدوسري', 'الزهراني', 'العتيبي', 'الشمري', 'الغامدي']
+CITIES = ['الرياض', 'جدة', 'الدمام', 'مكة المكرمة', 'المدينة المنورة', 'أبها', 'تبوك']
+ORGANIZATIONS = ['مؤسسة النور للتجارة', 'شركة الأمل المحدودة', 'مكتب الإتقان للمحاماة', 'مصنع الخليج']
+LEAVE_KINDS = ['سنوية', 'مرضية', 'اضطرارية', 'أمومة']
+LICENSE_KINDS = ['بلدي', 'تجاري', 'دفاع مدني', 'صحي']
+COURTS = ['المحكمة العامة', 'المحكمة العمالية', 'المحكمة التجارية']
+PLATE_LETTERS = 'أبحدرسصطعقكلمنهوى'
+
+TRANSACTION_TYPES = [(1, 'عقد عمل', '📝'), (2, 'إجازة موظف', '🏖️'), (3, 'استمارة سيارة', '🚗'),
+                     (4, 'ترخيص', '📄'), (5, 'جلسة قضائية', '⚖️')]
+
+# توزيع الأيام المتبقية: (النسبة، من، إلى)
+END_DATE_DISTRIBUTION = [
+    (0.08, -90, -1),    # متأخرة
+    (0.12, 0, 7),       # عاجلة
+    (0.25, 8, 30),
+    (0.40, 31, 365),
+    (0.15, 366, 730),
+]
+
+
+def user_count(scale):
+    """عدد المستخدمين لحجم معين (20 معاملة لكل مستخدم في المتوسط)"""
+    return max(10, scale // 20)
+
+
+def generate_users(count, rng):
+    """(user_id, الاسم، الجوال) لكل مستخدم"""
+    for user_id in range(1, count + 1):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(FAMILY_NAMES)}"
+        yield user_id, name, f"+9665{user_id:08d}"
+
+
+def _title(type_id, rng):
+    person = f"{rng.choice(FIRST_NAMES)} {rng.choice(FAMILY_NAMES)}"
+    if type_id == 1:
+        return f"عقد عمل {person}"
+    if type_id == 2:
+        return f"إجازة {rng.choice(LEAVE_KINDS)} - {person}"
+    if type_id == 3:
+        plate = ''.join(rng.choice(PLATE_LETTERS) for _ in range(3))
+        return f"تجديد استمارة سيارة {plate} {rng.randint(1000, 9999)}"
+    if type_id == 4:
+        return f"ترخيص {rng.choice(LICENSE_KINDS)} - {rng.choice(ORGANIZATIONS)}"
+    return f"جلسة قضائية رقم {rng.randint(100, 99999)} - {rng.choice(COURTS)}"
+
+
+def _days_left(rng):
+    roll = rng.random()
+    for share, low, high in END_DATE_DISTRIBUTION:
+        if roll < share:
+            return rng.randint(low, high)
+        roll -= share
+    return rng.randint(31, 365)
+
+
+def generate_transactions(start, end, users, rng, today):
+    """معاملات بأرقام من start+1 إلى end (حتمية لنفس البذرة)"""
+    for transaction_id in range(start + 1, end + 1):
+        type_id = rng.randint(1, 5)
+        is_active = rng.random() < 0.85
+        yield {
+            'transaction_id': transaction_id,
+            'transaction_type_id': type_id,
+            'user_id': rng.randint(1, users),
+            'title': _title(type_id, rng),
+            'description': f"متابعة لدى {rng.choice(ORGANIZATIONS)}",
+            'data': {'المدينة': rng.choice(CITIES), 'رقم_المرجع': f"REF-{transaction_id:07d}"},
+            'end_date': today + timedelta(days=_days_left(rng)),
+            'priority': rng.choices(['normal', 'high', 'critical'], weights=[70, 20, 10])[0],
+            'status': 'active' if is_active else rng.choice(['completed', 'cancelled']),
+            'is_active': is_active,
+        }
+
+
+def generate_notifications(transaction, today):
+    """تنبيه لكل موعد تذكير؛ التنبيهات التي فات موعدها مرسلة كما في الإنتاج"""
+    for days_before in REMINDER_OFFSETS:
+        fire_at = transaction['end_date'] - timedelta(days=days_before)
+        yield transaction['transaction_id'], transaction['user_id'], days_before, fire_at, fire_at < today
+
+
+def _chunks(total):
+    for start in range(0, total, CHUNK_SIZE):
+        yield start, min(start + CHUNK_SIZE, total)
+
+# ==================== خلفية SQLite ====================
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, performance_profile=False):
+        self.performance_profile = performance_profile
+        self.workdir = None
+
+    def load(self, scale):
+        from database import Database
+
+        self.workdir = tempfile.mkdtemp(prefix='bench_suite_')
+        db = Database(os.path.join(self.workdir, 'suite.db'), performance_profile=self.performance_profile)
+        rng = random.Random(SEED)
+        today = date.today()
+        users = user_count(scale)
+
+        db.cursor.executemany(
+            'INSERT INTO users (user_id, full_name, phone_number) VALUES (?, ?, ?)',
+            [(user_id, name, phone) for user_id, name, phone in generate_users(users, rng)]
+        )
+        for start, end in _chunks(scale):
+            transactions = list(generate_transactions(start, end, users, rng, today))
+            db.cursor.executemany(
+                'INSERT INTO transactions (transaction_id, transaction_type_id, user_id, title, data, end_date, is_active) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(t['transaction_id'], t['transaction_type_id'], t['user_id'], t['title'],
+                  json.dumps(t['data'], ensure_ascii=False), t['end_date'].isoformat(), int(t['is_active']))
+                 for t in transactions]
+            )
+            db.cursor.executemany(
+                'INSERT INTO notifications (transaction_id, days_before, recipients, sent) VALUES (?, ?, ?, ?)',
+                [(transaction_id, days_before, json.dumps([user_id]), int(sent))
+                 for t in transactions
+                 for transaction_id, user_id, days_before, _, sent in generate_notifications(t, today)]
+            )
+            db.conn.commit()
+        db.cursor.execute('ANALYZE')
+        return db
+
+    def endpoints(self, db):
+        # نقاط API وweb_app مبنية على خلفية PostgreSQL
+        return {}
+
+    def cleanup(self, db):
+        db.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+# ==================== خلفية PostgreSQL ====================
+
+POSTGRES_SCHEMA = """
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        telegram_username TEXT,
+        phone_number TEXT,
+        email TEXT,
+        role TEXT DEFAULT 'user',
+        department TEXT,
+        is_active BOOLEAN DEFAULT true,
+        created_at TIMESTAMP DEFAULT NOW(),
+        last_active TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE transaction_types (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        icon TEXT,
+        level INTEGER DEFAULT 1,
+        parent_id INTEGER,
+        is_active BOOLEAN DEFAULT true
+    );
+
+    CREATE TABLE transactions (
+        transaction_id BIGSERIAL PRIMARY KEY,
+        transaction_type_id INTEGER NOT NULL,
+        user_id BIGINT NOT NULL,
+        responsible_person_id BIGINT,
+        title TEXT NOT NULL,
+        description TEXT,
+        data JSONB,
+        start_date DATE DEFAULT CURRENT_DATE,
+        end_date DATE NOT NULL,
+        priority TEXT DEFAULT 'normal',
+        status TEXT DEFAULT 'active',
+        is_active BOOLEAN DEFAULT true,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE notifications (
+        notification_id BIGSERIAL PRIMARY KEY,
+        transaction_id BIGINT NOT NULL,
+        days_before INTEGER NOT NULL,
+        recipients BIGINT[],
+        notification_type TEXT DEFAULT 'scheduled',
+        message TEXT,
+        sent BOOLEAN DEFAULT false,
+        sent_at TIMESTAMP,
+        fire_at DATE,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE INDEX idx_transactions_user_id ON transactions (user_id);
+    CREATE INDEX idx_notifications_transaction_id ON notifications (transaction_id);
+"""
+
+
+class PostgresBackend:
+    name = 'postgres'
+
+    def __init__(self, url=None):
+        self.url = url or os.getenv('DATABASE_URL')
+        self._pgoptions = None
+
+    def load(self, scale):
+        from database_supabase import Database
+        from migrations import run_migrations
+
+        # كل الاتصالات (بما فيها اتصالات Database) تعمل داخل schema القياس
+        self._pgoptions = os.environ.get('PGOPTIONS')
+        os.environ['PGOPTIONS'] = f"-c search_path={SUITE_SCHEMA},public"
+
+        rng = random.Random(SEED)
+        today = date.today()
+        users = user_count(scale)
+
+        conn = psycopg2.connect(self.url)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SUITE_SCHEMA} CASCADE")
+                cur.execute(f"CREATE SCHEMA {SUITE_SCHEMA}")
+                cur.execute(POSTGRES_SCHEMA)
+                execute_values(
+                    cur, "INSERT INTO transaction_types (id, name, icon) VALUES %s", TRANSACTION_TYPES
+                )
+                execute_values(
+                    cur, "INSERT INTO users (user_id, full_name, phone_number) VALUES %s",
+                    list(generate_users(users, rng)), page_size=CHUNK_SIZE
+                )
+                for start, end in _chunks(scale):
+                    transactions = list(generate_transactions(start, end, users, rng, today))
+                    execute_values(
+                        cur,
+                        "INSERT INTO transactions (transaction_id, transaction_type_id, user_id, "
+                        "responsible_person_id, title, description, data, end_date, priority, status, "
+                        "is_active) VALUES %s",
+                        [(t['transaction_id'], t['transaction_type_id'], t['user_id'], t['user_id'],
+                          t['title'], t['description'], Json(t['data']), t['end_date'], t['priority'],
+                          t['status'], t['is_active'])
+                         for t in transactions],
+                        page_size=CHUNK_SIZE
+                    )
+                    execute_values(
+                        cur,
+                        "INSERT INTO notifications (transaction_id, recipients, days_before, fire_at, sent) "
+                        "VALUES %s",
+                        [(transaction_id, [user_id], days_before, fire_at, sent)
+                         for t in transactions
+                         for transaction_id, user_id, days_before, fire_at, sent in generate_notifications(t, today)],
+                        page_size=CHUNK_SIZE
+                    )
+                    conn.commit()
+                cur.execute("SELECT setval('transactions_transaction_id_seq', %s)", (scale,))
+            conn.commit()
+        finally:
+            conn.close()
+
+        # الفهارس والعدادات كما في الإنتاج
+        run_migrations(self.url)
+        db = Database(self.url)
+        with db.transaction() as cur:
+            cur.execute("ANALYZE")
+        return db
+
+    def endpoints(self, db):
+        import api
+        import web_app
+
+        api.db = db
+        web_app.db = db
+        api_client = api.api.test_client()
+        web_client = web_app.app.test_client()
+        headers = {'X-API-Key': os.environ['API_KEY']} if os.environ.get('API_KEY') else {}
+        return {
+            'GET /api/v1/stats': lambda: api_client.get('/api/v1/stats', headers=headers),
+            'GET /api/stats (web_app)': lambda: web_client.get('/api/stats'),
+        }
+
+    def cleanup(self, db):
+        db.close()
+        conn = psycopg2.connect(self.url)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SUITE_SCHEMA} CASCADE")
+            conn.commit()
+        finally:
+            conn.close()
+            if self._pgoptions is None:
+                os.environ.pop('PGOPTIONS', None)
+            else:
+                os.environ['PGOPTIONS'] = self._pgoptions
+
+# ==================== القياس ====================
+
+SEARCH_TERM = 'إجازة'
+BENCH_USER_ID = 1
+
+
+def hot_paths(db):
+    """المسارات الساخنة: الاسم -> دالة (None إذا لم تدعمها الخلفية)"""
+    def supported(method, call):
+        return call if hasattr(db, method) else None
+
+    return {
+        'get_pending_notifications': lambda: db.get_pending_notifications(),
+        'get_active_transactions': lambda: db.get_active_transactions(),
+        'get_active_transactions(user)': lambda: db.get_active_transactions(user_id=BENCH_USER_ID),
+        'get_active_transactions_page': lambda: db.get_active_transactions_page(limit=50),
+        'get_user_statistics': supported(
+            'get_user_statistics', lambda: db.get_user_statistics(BENCH_USER_ID)),
+        'search_transactions': supported(
+            'search_transactions', lambda: db.search_transactions(BENCH_USER_ID, SEARCH_TERM)),
+        'get_urgency_buckets': lambda: db.get_urgency_buckets(),
+        'get_statistics': supported('get_statistics', lambda: db.get_statistics()),
+    }
+
+
+def _size(result):
+    if hasattr(result, 'status_code'):
+        return None
+    if isinstance(result, tuple):
+        result = result[0]
+    return len(result) if isinstance(result, (list, dict)) else None
+
+
+def measure(call, runs):
+    """تشغيل إحماء ثم runs مرات - يرجع ملخص الأزمنة بالملي ثانية"""
+    result = call()
+    if getattr(result, 'status_code', 200) != 200:
+        return {'error': f"HTTP {result.status_code}"}
+
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'runs': runs,
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'min_ms': round(min(samples), 3),
+        'max_ms': round(max(samples), 3),
+        'rows': _size(result),
+    }
+
+
+def run_scale(backend, scale, runs):
+    print(f"\n📦 {backend.name}: توليد {scale:,} معاملة...")
+    started = time.perf_counter()
+    db = backend.load(scale)
+    load_seconds = round(time.perf_counter() - started, 2)
+    print(f"  ✅ تم التحميل في {load_seconds} ثانية")
+
+    results = {}
+    try:
+        operations = {**hot_paths(db), **backend.endpoints(db)}
+        for name, call in operations.items():
+            if call is None:
+                results[name] = {'skipped': 'not supported by backend'}
+                continue
+            try:
+                results[name] = measure(call, runs)
+            except Exception as e:
+                results[name] = {'error': str(e)}
+            print(f"  ⏱️ {name}: {results[name].get('median_ms', '-')} ms")
+    finally:
+        backend.cleanup(db)
+
+    return {'scale': scale, 'users': user_count(scale), 'load_seconds': load_seconds, 'results': results}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    if args.backend == 'sqlite':
+        backend = SQLiteBackend(performance_profile=args.performance_profile)
+    else:
+        backend = PostgresBackend()
+
+    report = {
+        'backend': backend.name,
+        'performance_profile': args.performance_profile if backend.name == 'sqlite' else None,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'runs': args.runs,
+        'seed': SEED,
+        'scales': [run_scale(backend, scale, args.runs) for scale in args.scales],
+    }
+
+    output = args.output or os.path.join(
+        'benchmark_results', f"{backend.name}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 تم حفظ النتائج في {output}")
+
+
+def compare(args):
+    """مقارنة وسيط الأزمنة بين تشغيلين لكل حجم ومسار"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = {s['scale']: s['results'] for s in json.load(f)['scales']}
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = {s['scale']: s['results'] for s in json.load(f)['scales']}
+
+    rows = []
+    for scale in sorted(set(baseline) & set(candidate)):
+        for name, before in baseline[scale].items():
+            after = candidate[scale].get(name, {})
+            if 'median_ms' not in before or 'median_ms' not in after:
+                continue
+            ratio = after['median_ms'] / before['median_ms'] if before['median_ms'] else 0
+            rows.append((f"{scale:,}", name, before['median_ms'], after['median_ms'], f"{ratio:.2f}x"))
+    print_table(['scale', 'operation', 'baseline (ms)', 'candidate (ms)', 'ratio'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس أداء المسارات الساخنة على بيانات اصطناعية')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    run_parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    run_parser.add_argument('--performance-profile', action='store_true',
+                            help='تفعيل ملف تعريف أداء SQLite')
+    run_parser.add_argument('--output', help='ملف JSON للنتائج')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
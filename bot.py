@@ -2,13 +2,16 @@ import logging
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+from async_database import AsyncDatabase
+
 logger = logging.getLogger(__name__)
 
 class TransactionBot:
     def __init__(self, token, database):
         self.token = token
-        self.db = database
-        self.app = Application.builder().token(token).build()
+        # استدعاءات قاعدة البيانات تُنفذ خارج حلقة asyncio فلا تحجب تحديثات المستخدمين الآخرين
+        self.db = database if isinstance(database, AsyncDatabase) else AsyncDatabase(database)
+        self.app = Application.builder().token(token).concurrent_updates(True).build()
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -22,8 +25,8 @@ class TransactionBot:
         user = update.effective_user
         
         # تسجيل المستخدم
-        if not self.db.get_user(user.id):
-            self.db.add_user(
+        if not await self.db.get_user(user.id):
+            await self.db.add_user(
                 user_id=user.id,
                 full_name=user.full_name or user.username,
                 telegram_username=user.username
@@ -63,7 +66,7 @@ class TransactionBot:
         """عرض الإحصائيات"""
         try:
             user_id = update.effective_user.id
-            stats = self.db.get_user_statistics(user_id)
+            stats = await self.db.get_user_statistics(user_id)
             
             stats_text = f"""
 📈 **إحصائياتك:**
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """ذاكرة مؤقتة في الذاكرة بمدة صلاحية (TTL) وإخراج الأقدم استخداماً (LRU)، آمنة للـ Threads"""
+
+    def __init__(self, maxsize=128, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key, default=None):
+        """القيمة المخزنة أو default إذا لم توجد أو انتهت صلاحيتها"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats['misses'] += 1
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """تخزين قيمة مع إخراج الأقدم استخداماً عند الامتلاء"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, key):
+        """حذف مفتاح واحد"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """حذف كل القيم المخزنة"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """إحصائيات الإصابة والإخفاق"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
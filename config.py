@@ -10,8 +10,37 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'ضع_توكن_البوت_
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', 'ضع_مفتاح_DeepSeek_هنا')
 DEEPSEEK_API_URL = 'https://api.deepseek.com/v1/chat/completions'
 
+# عميل DeepSeek: اتصالات keep-alive مُجمّعة، مهلة الطلب، وذاكرة مؤقتة للردود
+AI_MAX_CONNECTIONS = int(os.getenv('AI_MAX_CONNECTIONS', 10))
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', 30))
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', 256))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 600))
+
 # إعدادات قاعدة البيانات
 DATABASE_PATH = 'data/notifications.db'
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+# ملف تعريف الأداء لـ SQLite: WAL وإعدادات pragma واتصال لكل Thread
+SQLITE_PERFORMANCE_PROFILE = os.getenv('SQLITE_PERFORMANCE_PROFILE', 'false').lower() in ('1', 'true', 'yes')
+
+# مجمع اتصالات PostgreSQL (DB_POOL_MAX=0 يعني اتصالاً واحداً مشتركاً)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 0))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+# مجمع اتصالات خدمة الويب main.py (دائماً مجمع حقيقي، مستقل عن DB_POOL_MAX)
+MAIN_DB_POOL_MIN = int(os.getenv('MAIN_DB_POOL_MIN', 1))
+MAIN_DB_POOL_MAX = int(os.getenv('MAIN_DB_POOL_MAX', 10))
+
+# عدد Threads طبقة قاعدة البيانات غير المتزامنة عندما تسمح الخلفية بالتوازي
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', 8))
+
+# حجم صفحات قوائم المعاملات (keyset pagination)
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 500))
+
+# عدد الصفوف في كل دفعة عند تصدير المعاملات عبر server-side cursor
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
 
 # إعدادات الموقع
 WEB_PORT = int(os.getenv('PORT', 5000))
@@ -21,6 +50,72 @@ WEB_HOST = '0.0.0.0'
 MAX_NOTIFICATIONS_PER_ITEM = 3
 NOTIFICATION_CHECK_INTERVAL_HOURS = 1
 
+# إعادة حساب عدادات الإحصائيات العامة دورياً لتصحيح أي انحراف
+STATISTICS_RECONCILE_INTERVAL_HOURS = int(os.getenv('STATISTICS_RECONCILE_INTERVAL_HOURS', 6))
+
+# عدد صفوف عدادات الإحصائيات (توزيع الكتابات المتزامنة بدلاً من صف واحد مقفل)
+STATISTICS_SHARDS = int(os.getenv('STATISTICS_SHARDS', 8))
+
+# ترحيل المخطط (migrations.py): عدد الصفوف في كل دفعة تعبئة، ومهلة انتظار الأقفال لكل جملة
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', 10000))
+MIGRATION_LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '5s')
+
+# الحد الأقصى لعدد الرسائل المرسلة بالتوازي في كل دورة تنبيهات
+NOTIFICATION_CONCURRENCY = int(os.getenv('NOTIFICATION_CONCURRENCY', 20))
+
+# حدود معدل تيليجرام (رسالة/ثانية) وعدد مرات إعادة المحاولة عند الفشل المؤقت
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_PER_CHAT_RATE = float(os.getenv('TELEGRAM_PER_CHAT_RATE', 1))
+NOTIFICATION_MAX_RETRIES = int(os.getenv('NOTIFICATION_MAX_RETRIES', 3))
+
+# التنبيهات غير المكتملة (فشل مؤقت أو دورة فائتة) تُعاد محاولتها حتى هذا العدد من الأيام بعد موعدها
+NOTIFICATION_LOOKBACK_DAYS = int(os.getenv('NOTIFICATION_LOOKBACK_DAYS', 7))
+
+# عدد التنبيهات المُرسلة التي تُعلَّم في قاعدة البيانات دفعة واحدة
+NOTIFICATION_ACK_BATCH_SIZE = int(os.getenv('NOTIFICATION_ACK_BATCH_SIZE', 100))
+
+# وضع الملخص: رسالة واحدة لكل مستخدم تجمع كل تنبيهاته في الدورة
+NOTIFICATION_DIGEST_MODE = os.getenv('NOTIFICATION_DIGEST_MODE', 'false').lower() in ('1', 'true', 'yes')
+
+# استقبال المعاملات دفعة واحدة: الحد الأقصى للعناصر في الطلب وعدد الصفوف في كل جملة INSERT
+WEBHOOK_BATCH_MAX = int(os.getenv('WEBHOOK_BATCH_MAX', 10000))
+BULK_PAGE_SIZE = int(os.getenv('BULK_PAGE_SIZE', 1000))
+
+# ذاكرة مؤقتة للمستخدمين وأنواع المعاملات (عدد العناصر ومدة الصلاحية بالثواني)
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', 1024))
+LOOKUP_CACHE_TTL = int(os.getenv('LOOKUP_CACHE_TTL', 300))
+
+# مدة تخزين صفحة لوحة المعلومات و/api/stats مؤقتاً (بالثواني)
+WEB_CACHE_TTL = int(os.getenv('WEB_CACHE_TTL', 30))
+
+# حدود تصنيف المعاملات النشطة حسب الأيام المتبقية: عاجلة / تحذير / آمنة
+URGENCY_CRITICAL_DAYS = 3
+URGENCY_WARNING_DAYS = 7
+
+# وضع البحث في المعاملات: indexed (نص عربي موحد + فهرس trigram) أو ilike
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'indexed')
+
+# منفذ خادم /metrics المستقل لنظام التنبيهات (0 = معطل)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# رمز الوصول لمسار /metrics في تطبيقات Flask (بدونه لا يُضاف المسار)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# محلل الاستعلامات (اختياري): إحصائيات لكل قالب استعلام، سجل الاستعلامات البطيئة،
+# ونسبة الاستعلامات البطيئة (SELECT فقط) التي يُؤخذ لها EXPLAIN (ANALYZE, BUFFERS).
+# EXPLAIN ANALYZE يُعيد تنفيذ الاستعلام البطيء كاملاً (في Thread خلفي على اتصال مستقل)،
+# أي حمل إضافي على قاعدة البيانات بقدر الاستعلام نفسه لكل عينة، بحد أقصى مرة لكل قالب خلال المهلة
+QUERY_PROFILER_ENABLED = os.getenv('QUERY_PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', 0))
+EXPLAIN_COOLDOWN_SECONDS = int(os.getenv('EXPLAIN_COOLDOWN_SECONDS', 600))
+
+# مواعيد التذكير (بالأيام قبل الانتهاء) الافتراضية ولكل نوع معاملة
+DEFAULT_REMINDER_OFFSETS = [30, 15, 7, 3, 0]
+REMINDER_OFFSETS_BY_TYPE = {
+    # transaction_type_id: [أيام قبل الانتهاء]
+}
+
 # أنواع المعاملات القابلة للتوسع
 TRANSACTION_TYPES = [
     'عقد_عمل',
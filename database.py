@@ -1,15 +1,86 @@
 import sqlite3
 import json
+import threading
 from datetime import datetime
 
+from cache import TTLCache
+from config import (
+    LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, SQLITE_PERFORMANCE_PROFILE,
+    URGENCY_CRITICAL_DAYS, URGENCY_WARNING_DAYS
+)
+from pagination import build_page, clamp_limit, decode_cursor
+
+# إعدادات ملف تعريف الأداء (تُطبق على كل اتصال)
+PERFORMANCE_PRAGMAS = [
+    # القراء لا يحجبون الكاتب في وضع WAL
+    ('journal_mode', 'WAL'),
+    # آمن مع WAL: لا fsync عند كل commit بل عند نقاط التفتيش فقط
+    ('synchronous', 'NORMAL'),
+    # ذاكرة مؤقتة 64MB (القيمة السالبة بالكيلوبايت)
+    ('cache_size', -64000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+    # انتظار القفل بدلاً من خطأ "database is locked" فوراً
+    ('busy_timeout', 5000),
+]
+
+# عدد التنبيهات في جملة UPDATE واحدة (3 معاملات لكل تنبيه، والحد القديم لـ SQLite 999)
+SQLITE_MAX_ACKS_PER_STATEMENT = 300
+
 class Database:
-    def __init__(self, db_name='transactions.db'):
+    def __init__(self, db_name='transactions.db', performance_profile=None):
         self.db_name = db_name
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.cursor = self.conn.cursor()
+        if performance_profile is None:
+            performance_profile = SQLITE_PERFORMANCE_PROFILE
+        # قاعدة :memory: خاصة بالاتصال، فلا يمكن فتح اتصال لكل Thread
+        self.performance_profile = performance_profile and db_name != ':memory:'
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # المستخدمون وأنواع المعاملات نادراً ما تتغير
+        self.user_cache = TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+        self.type_cache = TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+        self._shared = None
+        if not self.performance_profile:
+            self._shared = self._open_connection()
+            self._shared_cursor = self._shared.cursor()
         self.create_tables()
     
+    def _open_connection(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if self.performance_profile:
+            for name, value in PERFORMANCE_PRAGMAS:
+                conn.execute(f'PRAGMA {name} = {value}')
+        with self._connections_lock:
+            # إغلاق اتصالات الـ Threads المنتهية (خادم Flask ينشئ Thread لكل طلب)
+            alive = []
+            for thread, old_conn in self._connections:
+                if thread.is_alive():
+                    alive.append((thread, old_conn))
+                else:
+                    old_conn.close()
+            alive.append((threading.current_thread(), conn))
+            self._connections = alive
+        return conn
+    
+    def _thread_state(self):
+        """الاتصال والمؤشر الخاصان بالـ Thread الحالي"""
+        if self._shared is not None:
+            return self._shared, self._shared_cursor
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = self._open_connection()
+            self._local.cursor = self._local.conn.cursor()
+        return self._local.conn, self._local.cursor
+    
+    @property
+    def conn(self):
+        return self._thread_state()[0]
+    
+    @property
+    def cursor(self):
+        return self._thread_state()[1]
+    
     def create_tables(self):
         """إنشاء جداول قاعدة البيانات"""
         
@@ -58,10 +129,32 @@ class Database:
                 recipients TEXT NOT NULL,
                 sent INTEGER DEFAULT 0,
                 last_sent TIMESTAMP,
+                delivered_to TEXT,
+                failed_to TEXT,
                 FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id)
             )
         ''')
         
+        # قواعد البيانات القديمة: المستلمون الذين استلموا التنبيه فعلاً أو فشل إرسالهم نهائياً (JSON)
+        columns = [row[1] for row in self.cursor.execute('PRAGMA table_info(notifications)').fetchall()]
+        for column in ('delivered_to', 'failed_to'):
+            if column not in columns:
+                self.cursor.execute(f'ALTER TABLE notifications ADD COLUMN {column} TEXT')
+        
+        # فهارس الاستعلامات الساخنة: المعاملات النشطة، معاملات المستخدم، التنبيهات المعلقة
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_transactions_active_end_date
+            ON transactions (is_active, end_date)
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_transactions_user_id
+            ON transactions (user_id)
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notifications_sent_transaction
+            ON notifications (sent, transaction_id)
+        ''')
+        
         # إضافة أنواع المعاملات الافتراضية
         types = [
             (1, 'عقد عمل', '📝'),
@@ -94,15 +187,22 @@ class Database:
         except Exception as e:
             print(f"خطأ في إضافة المستخدم: {e}")
             return False
+        finally:
+            # أي كتابة على users تُبطل النسخة المخزنة مؤقتاً، حتى عند الفشل
+            self.user_cache.invalidate(user_id)
     
     def get_user(self, user_id):
         """جلب بيانات مستخدم"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
         try:
             row = self.cursor.execute('''
                 SELECT * FROM users WHERE user_id = ?
             ''', (user_id,)).fetchone()
             
             if row:
+                self.user_cache.set(user_id, dict(row))
                 return dict(row)
             return None
         except:
@@ -124,6 +224,8 @@ class Database:
             return True
         except:
             return False
+        finally:
+            self.user_cache.invalidate(user_id)
     
     def add_transaction(self, transaction_type_id, user_id, title, data, end_date):
         """إضافة معاملة جديدة"""
@@ -215,6 +317,77 @@ class Database:
             print(f"خطأ في جلب المعاملات: {e}")
             return []
     
+    def get_urgency_buckets(self, user_id=None, critical_days=URGENCY_CRITICAL_DAYS,
+                            warning_days=URGENCY_WARNING_DAYS):
+        """عدد المعاملات النشطة حسب الأيام المتبقية (عاجلة/تحذير/آمنة) في استعلام واحد"""
+        try:
+            where = 'WHERE is_active = 1'
+            params = {'critical': critical_days, 'warning': warning_days}
+            if user_id:
+                where += ' AND user_id = :user_id'
+                params['user_id'] = user_id
+            
+            # التواريخ غير الصالحة تعطي NULL فتُحسب آمنة
+            row = self.cursor.execute(f'''
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(days_left <= :critical), 0) AS critical,
+                       COALESCE(SUM(days_left > :critical AND days_left <= :warning), 0) AS warning,
+                       COALESCE(SUM(days_left IS NULL OR days_left > :warning), 0) AS safe
+                FROM (
+                    SELECT julianday(end_date) - julianday(date('now', 'localtime')) AS days_left
+                    FROM transactions
+                    {where}
+                )
+            ''', params).fetchone()
+            return dict(row)
+        except Exception as e:
+            print(f"خطأ في حساب تصنيف المعاملات: {e}")
+            return dict.fromkeys(('total', 'critical', 'warning', 'safe'), 0)
+    
+    def get_active_transactions_page(self, user_id=None, limit=None, cursor=None):
+        """جلب صفحة من المعاملات النشطة مرتبة حسب (end_date, transaction_id)
+        
+        يرجع (المعاملات، مؤشر الصفحة التالية أو None). يرفع ValueError إذا كان المؤشر غير صالح
+        وRuntimeError إذا فشل الاستعلام.
+        """
+        limit = clamp_limit(limit)
+        conditions = ['is_active = 1']
+        params = []
+        
+        if user_id:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        
+        if cursor:
+            # end_date إلزامي في SQLite، فمؤشر بتاريخ None لا يليه شيء
+            end_date, transaction_id = decode_cursor(cursor)
+            conditions.append('(end_date, transaction_id) > (?, ?)')
+            params += [end_date.isoformat() if end_date else None, transaction_id]
+        
+        try:
+            rows = self.cursor.execute(f'''
+                SELECT * FROM transactions 
+                WHERE {' AND '.join(conditions)}
+                ORDER BY end_date, transaction_id
+                LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+            
+            transactions = []
+            for row in rows:
+                trans = dict(row)
+                if trans.get('data'):
+                    try:
+                        trans['data'] = json.loads(trans['data'])
+                    except:
+                        trans['data'] = {}
+                transactions.append(trans)
+            
+            return build_page(transactions, limit)
+        except Exception as e:
+            # لا تُرجع صفحة فارغة: تبدو للعميل كنهاية القائمة
+            print(f"خطأ في جلب المعاملات: {e}")
+            raise RuntimeError('Failed to load transactions page') from e
+    
     def delete_transaction(self, transaction_id):
         """حذف معاملة"""
         try:
@@ -251,11 +424,11 @@ class Database:
             notifications = []
             for row in rows:
                 notif = dict(row)
-                if notif.get('recipients'):
+                for key in ('recipients', 'delivered_to', 'failed_to'):
                     try:
-                        notif['recipients'] = json.loads(notif['recipients'])
+                        notif[key] = json.loads(notif[key]) if notif.get(key) else []
                     except:
-                        notif['recipients'] = []
+                        notif[key] = []
                 notifications.append(notif)
             
             return notifications
@@ -275,14 +448,109 @@ class Database:
         except:
             return False
     
+    def mark_notifications_sent(self, acks):
+        """تعليم دفعة تنبيهات كمُرسلة بجملة واحدة - acks: [(notification_id, sent_at), ...]"""
+        acks = list(acks)
+        if not acks:
+            return True
+        try:
+            # جملة UPDATE واحدة لكل دفعة (CASE ... IN) ضمن حد SQLite لعدد المعاملات في الجملة
+            for start in range(0, len(acks), SQLITE_MAX_ACKS_PER_STATEMENT):
+                batch = [
+                    (notification_id, sent_at.isoformat() if isinstance(sent_at, datetime) else sent_at)
+                    for notification_id, sent_at in acks[start:start + SQLITE_MAX_ACKS_PER_STATEMENT]
+                ]
+                self.cursor.execute(f'''
+                    UPDATE notifications 
+                    SET sent = 1,
+                        last_sent = CASE notification_id {' '.join(['WHEN ? THEN ?'] * len(batch))} END
+                    WHERE notification_id IN ({', '.join(['?'] * len(batch))})
+                ''', [value for ack in batch for value in ack] + [notification_id for notification_id, _ in batch])
+            self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"خطأ في تحديث حالة التنبيهات: {e}")
+            self.conn.rollback()
+            return False
+    
+    def record_notification_deliveries(self, deliveries):
+        """حفظ نتائج المستلمين لتنبيهات لم تكتمل - deliveries: [(notification_id, [من استلم], [من فشل نهائياً]), ...]"""
+        try:
+            for notification_id, user_ids, failed_ids in deliveries:
+                row = self.cursor.execute(
+                    'SELECT delivered_to, failed_to FROM notifications WHERE notification_id = ?', (notification_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                delivered = json.loads(row[0]) if row[0] else []
+                delivered += [user_id for user_id in user_ids if user_id not in delivered]
+                failed = json.loads(row[1]) if row[1] else []
+                failed += [user_id for user_id in failed_ids if user_id not in failed]
+                self.cursor.execute(
+                    'UPDATE notifications SET delivered_to = ?, failed_to = ? WHERE notification_id = ?',
+                    (json.dumps(delivered), json.dumps(failed), notification_id)
+                )
+            self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"خطأ في حفظ مستلمي التنبيهات: {e}")
+            self.conn.rollback()
+            return False
+    
     def get_transaction_types(self):
         """جلب أنواع المعاملات"""
+        cached = self.type_cache.get('all')
+        if cached is not None:
+            return [dict(t) for t in cached]
         try:
             rows = self.cursor.execute('SELECT * FROM transaction_types').fetchall()
-            return [dict(row) for row in rows]
+            types = [dict(row) for row in rows]
+            self.type_cache.set('all', types)
+            return [dict(t) for t in types]
         except:
             return []
     
+    def get_transaction_type_name(self, type_id):
+        """جلب اسم نوع المعاملة"""
+        name = self.type_cache.get(('name', type_id))
+        if name is not None:
+            return name
+        try:
+            row = self.cursor.execute(
+                'SELECT name FROM transaction_types WHERE id = ?', (type_id,)
+            ).fetchone()
+            if not row:
+                return 'غير معروف'
+            self.type_cache.set(('name', type_id), row['name'])
+            return row['name']
+        except:
+            return 'غير معروف'
+    
+    def add_transaction_type(self, name, icon=None, type_id=None):
+        """إضافة نوع معاملة"""
+        try:
+            self.cursor.execute('''
+                INSERT INTO transaction_types (id, name, icon)
+                VALUES (?, ?, ?)
+            ''', (type_id, name, icon))
+            self.conn.commit()
+            self.type_cache.clear()
+            return self.cursor.lastrowid
+        except Exception as e:
+            print(f"خطأ في إضافة نوع المعاملة: {e}")
+            self.conn.rollback()
+            return None
+    
+    def cache_stats(self):
+        """إحصائيات الذاكرة المؤقتة للمستخدمين وأنواع المعاملات"""
+        return {
+            'users': self.user_cache.stats(),
+            'transaction_types': self.type_cache.stats(),
+        }
+    
     def close(self):
-        """إغلاق الاتصال"""
-        self.conn.close()
+        """إغلاق الاتصال (جميع اتصالات الـ Threads في ملف تعريف الأداء)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for _, conn in connections:
+            conn.close()
@@ -1,61 +1,433 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime, timedelta
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, date
+import functools
 import logging
+import threading
+import time
+import uuid
+
+from config import (
+    BULK_PAGE_SIZE, DATABASE_URL, DB_POOL_MAX, DB_POOL_MIN, DB_POOL_TIMEOUT,
+    DEFAULT_REMINDER_OFFSETS, EXPLAIN_COOLDOWN_SECONDS, EXPLAIN_SAMPLE_RATE, LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, EXPORT_CHUNK_SIZE, REMINDER_OFFSETS_BY_TYPE,
+    NOTIFICATION_LOOKBACK_DAYS, STATISTICS_RECONCILE_INTERVAL_HOURS,
+    QUERY_PROFILER_ENABLED, SEARCH_MODE, SLOW_QUERY_MS, URGENCY_CRITICAL_DAYS, URGENCY_WARNING_DAYS
+)
+from cache import TTLCache
+from arabic_text import (
+    escape_like, normalize_arabic, search_document_sql
+)
+from db_pool import ConnectionPool
+from metrics import counter, histogram
+from pagination import build_page, clamp_limit, decode_cursor
+from query_profiler import QueryProfiler
 
 logger = logging.getLogger(__name__)
 
+QUERY_SECONDS = histogram('db_query_duration_seconds', 'SQL statement latency by calling method', ('query',))
+QUERY_ERRORS = counter('db_query_errors_total', 'Failed SQL statements by calling method', ('query',))
+
+
+class ProfiledCursor(RealDictCursor):
+    """RealDictCursor يبلغ عن زمن كل جملة (execute_query وtransaction وexecute_values)
+
+    observer(query, params, elapsed_seconds, failed) يُعيَّن بعد إنشاء المؤشر. في المؤشر المُسمّى
+    (server-side) يتم العمل الفعلي أثناء fetch، لذا يُبلغ عن الزمن الكلي عند الإغلاق.
+    """
+    observer = None
+    _pending = None
+
+    def execute(self, query, vars=None):
+        if self.observer is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            self.observer(query, vars, time.perf_counter() - started, True)
+            raise
+        if self.name:
+            self._pending = [query, vars, time.perf_counter() - started]
+        else:
+            self.observer(query, vars, time.perf_counter() - started, False)
+        return result
+
+    def _timed_fetch(self, fetch, *args):
+        if self._pending is None:
+            return fetch(*args)
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._pending[2] += time.perf_counter() - started
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def close(self):
+        pending, self._pending = self._pending, None
+        try:
+            super().close()
+        finally:
+            if pending is not None:
+                self.observer(*pending, False)
+
+
+USER_STATISTICS_KEYS = (
+    'total_transactions', 'active_transactions', 'completed_transactions',
+    'cancelled_transactions', 'normal_transactions', 'high_priority_transactions',
+    'critical_priority_transactions', 'due_soon', 'pending_notifications'
+)
+
+ACTIVE_TRANSACTIONS_QUERY = """
+    SELECT t.*, tt.name as type_name, tt.icon, u.full_name as user_name,
+           (t.end_date - CURRENT_DATE) as days_left
+    FROM transactions t
+    LEFT JOIN transaction_types tt ON t.transaction_type_id = tt.id
+    LEFT JOIN users u ON t.user_id = u.user_id
+    WHERE t.is_active = true
+"""
+
+# العدادات العامة في statistics_counters: الجدول -> {العداد: شرط الصف المحسوب}
+#
+# كل جملة كتابة على هذه الجداول تُحدّث صف عداد واحداً ويبقى مقفلاً حتى نهاية معاملتها،
+# لذا تُوزع العدادات على STATISTICS_SHARDS صفاً (حسب pid الاتصال) والقيمة الفعلية هي مجموعها،
+# فلا تتسلسل الكتابات المتزامنة من اتصالات مختلفة على صف واحد.
+STATISTICS_COUNTERS = {
+    'transactions': {
+        'total_transactions': "is_active IS TRUE",
+        'active_transactions': "is_active IS TRUE AND status = 'active'",
+    },
+    'users': {
+        'total_users': "is_active IS TRUE",
+    },
+    'notifications': {
+        'pending_notifications': "sent IS FALSE",
+    },
+}
+
+
+# triggers العدادات (جداول الانتقال لا تسمح بأكثر من حدث في نفس الـ trigger)
+STATISTICS_TRIGGER_EVENTS = [
+    ('INSERT', 'NEW TABLE AS new_rows'),
+    ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    ('DELETE', 'OLD TABLE AS old_rows'),
+]
+STATISTICS_TRIGGERS = [
+    f"statistics_{table}_{event.lower()}"
+    for table in STATISTICS_COUNTERS for event, _ in STATISTICS_TRIGGER_EVENTS
+]
+
+# كائنات المخطط (ينشئها migrations.py) التي تعتمد عليها كل ميزة: [(النوع، الاسم)]
+SCHEMA_FEATURES = {
+    'fire_at': [
+        ('column', 'notifications.fire_at'),
+        ('trigger', 'notifications_fire_at'),
+        ('trigger', 'transactions_end_date_fire_at'),
+        ('index', 'idx_notifications_pending_fire_at'),
+    ],
+    'fire_at_column': [('column', 'notifications.fire_at')],
+    'deliveries': [('column', 'notifications.delivered_to'), ('column', 'notifications.failed_to')],
+    'idempotency': [('column', 'transactions.idempotency_key'), ('index', 'idx_transactions_idempotency_key')],
+    'search_index': [('function', 'normalize_arabic'), ('index', 'idx_transactions_search_trgm')],
+}
+
+
+def _statistics_totals_sql():
+    """مجموع العدادات على كل الصفوف"""
+    return ', '.join(
+        f"COALESCE(SUM({c}), 0)::bigint AS {c}"
+        for counters in STATISTICS_COUNTERS.values() for c in counters
+    )
+
+
+def _statistics_count_sql():
+    """العدادات محسوبة مباشرة من الجداول (COUNT(*)) عندما لا يمكن الوثوق بالعدادات التراكمية"""
+    return 'SELECT ' + ', '.join(
+        f"(SELECT COUNT(*) FROM {table} WHERE {condition}) AS {c}"
+        for table, counters in STATISTICS_COUNTERS.items()
+        for c, condition in counters.items()
+    )
+
+
+def _reconcile_statistics(cur):
+    """إعادة حساب العدادات من الجداول - يرجع (القيم السابقة، القيم الجديدة)"""
+    # قفل كل الصفوف أولاً: الجمل التالية تأخذ snapshot جديداً بعد انتهاء أي كتابة متزامنة
+    cur.execute("SELECT id FROM statistics_counters ORDER BY id FOR UPDATE")
+    cur.execute(f"SELECT {_statistics_totals_sql()} FROM statistics_counters")
+    before = cur.fetchone()
+    
+    # المجموع الصحيح في الصف 1 وبقية الصفوف تبدأ من الصفر
+    assignments = ', '.join(
+        f"{c} = CASE WHEN id = 1 THEN (SELECT COUNT(*) FROM {table} WHERE {condition}) ELSE 0 END"
+        for table, counters in STATISTICS_COUNTERS.items()
+        for c, condition in counters.items()
+    )
+    cur.execute(f"""
+        UPDATE statistics_counters
+        SET {assignments}, updated_at = NOW(), reconciled_at = NOW()
+    """)
+    cur.execute(f"SELECT {_statistics_totals_sql()} FROM statistics_counters")
+    return before, cur.fetchone()
+
 class Database:
-    def __init__(self, connection_string):
-        self.connection_string = connection_string
+    def __init__(self, connection_string=None, reminder_offsets=None,
+                 pool_min=DB_POOL_MIN, pool_max=DB_POOL_MAX, pool_timeout=DB_POOL_TIMEOUT,
+                 profiler=None):
+        self.connection_string = connection_string or DATABASE_URL
         self.conn = None
+        self._schema_ready = False
+        self.schema_features = {}
+        self.reminder_offsets = reminder_offsets if reminder_offsets is not None else REMINDER_OFFSETS_BY_TYPE
+        
+        # وضع المجمع: اتصال مستقل لكل استدعاء بدلاً من اتصال مشترك بين الـ Threads
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.pool_timeout = pool_timeout
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        
+        # المستخدمون وأنواع المعاملات نادراً ما تتغير
+        self.user_cache = TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+        self.type_cache = TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+        
+        # محلل الاستعلامات معطل افتراضياً (QUERY_PROFILER_ENABLED)
+        if profiler is None and QUERY_PROFILER_ENABLED:
+            profiler = QueryProfiler(
+                slow_threshold_ms=SLOW_QUERY_MS,
+                explain_sample_rate=EXPLAIN_SAMPLE_RATE,
+                explain_cooldown=EXPLAIN_COOLDOWN_SECONDS
+            )
+        self.profiler = profiler
+        self._explain_executor = None
+        self._reconcile_lock = threading.Lock()
+        
+        # يزيد مع كل كتابة على المعاملات من هذه العملية (إبطال فوري للذاكرة المؤقتة في web_app)
+        self.transactions_write_version = 0
+        self._write_version_lock = threading.Lock()
+    
+    def _get_pool(self):
+        """إنشاء مجمع الاتصالات عند أول استخدام"""
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    pool = ConnectionPool(
+                        self.connection_string,
+                        minconn=self.pool_min,
+                        maxconn=self.pool_max,
+                        timeout=self.pool_timeout
+                    )
+                    if not self._schema_ready:
+                        with pool.connection() as conn:
+                            self.check_schema(conn)
+                    self.pool = pool
+        return self.pool
+    
+    @contextmanager
+    def _connection(self):
+        """اتصال لمدة استدعاء واحد: من المجمع أو الاتصال المشترك"""
+        if self.pool_max:
+            with self._get_pool().connection() as conn:
+                yield conn
+            return
+        
+        conn = self.connect()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    
+    @contextmanager
+    def _dedicated_connection(self):
+        """اتصال لا يشاركه أي Thread آخر طوال الكتلة (مطلوب لـ server-side cursor)"""
+        if self.pool_max:
+            with self._get_pool().connection() as conn:
+                yield conn
+            return
+        
+        # في وضع الاتصال المشترك قد يُنهي commit من Thread آخر المؤشر، لذا نفتح اتصالاً مستقلاً
+        conn = psycopg2.connect(self.connection_string)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def pool_stats(self):
+        """إحصائيات مجمع الاتصالات (None في وضع الاتصال المشترك)"""
+        return self.pool.stats() if self.pool else None
     
     def connect(self):
         """إنشاء اتصال بقاعدة البيانات"""
         try:
             if not self.conn or self.conn.closed:
                 self.conn = psycopg2.connect(self.connection_string)
+                if not self._schema_ready:
+                    self.check_schema(self.conn)
             return self.conn
         except Exception as e:
             logger.error(f"خطأ في الاتصال بقاعدة البيانات: {e}")
             raise
     
+    def check_schema(self, conn):
+        """التحقق من كائنات المخطط التي ينشئها migrations.py (قراءة فقط، دون أي DDL)
+        
+        المسار الذي تنقصه كائناته يعمل بالطريقة القديمة أو يرفض الطلب بدلاً من خطأ SQL أو
+        عمل بطيء على جدول كامل. بعد تشغيل الترحيل يجب إعادة تشغيل العملية.
+        """
+        objects = {kind: [] for kind in ('column', 'index', 'trigger', 'function')}
+        for required in SCHEMA_FEATURES.values():
+            for kind, name in required:
+                objects[kind].append(name)
+        
+        query = """
+            SELECT 'column' AS kind, table_name || '.' || column_name AS name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name || '.' || column_name = ANY(%(column)s)
+            UNION ALL
+            SELECT 'index', c.relname
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indisvalid AND i.indexrelid IN (SELECT to_regclass(unnest(%(index)s)))
+            UNION ALL
+            SELECT 'trigger', t.tgname
+            FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid
+            WHERE NOT t.tgisinternal AND t.tgname = ANY(%(trigger)s)
+            AND c.relnamespace = current_schema()::regnamespace
+            UNION ALL
+            SELECT 'function', proname FROM pg_proc
+            WHERE proname = ANY(%(function)s) AND pg_function_is_visible(oid)
+        """
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, objects)
+                present = {(row['kind'], row['name']) for row in cur.fetchall()}
+            conn.rollback()
+        except Exception as e:
+            logger.error(f"خطأ في التحقق من مخطط قاعدة البيانات: {e}")
+            conn.rollback()
+            return
+        
+        self.schema_features = {
+            feature: all(item in present for item in required)
+            for feature, required in SCHEMA_FEATURES.items()
+        }
+        self._schema_ready = True
+        
+        missing = [feature for feature, ready in self.schema_features.items() if not ready]
+        if missing:
+            logger.error(f"مخطط قاعدة البيانات غير مكتمل ({', '.join(missing)}): شغّل python migrations.py")
+    
+    def has_schema(self, feature):
+        """هل كائنات المخطط اللازمة للميزة موجودة (SCHEMA_FEATURES)"""
+        if not self._schema_ready:
+            # التحقق يتم مع أول اتصال، ويُعاد هنا إذا فشل وقتها
+            try:
+                with self._connection() as conn:
+                    if not self._schema_ready:
+                        self.check_schema(conn)
+            except Exception as e:
+                logger.error(f"خطأ في التحقق من مخطط قاعدة البيانات: {e}")
+        return self.schema_features.get(feature, False)
+    
     def check_connection(self):
         """التحقق من الاتصال بقاعدة البيانات"""
         try:
-            conn = self.connect()
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1")
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
             return True
         except Exception as e:
             logger.error(f"فشل الاتصال بقاعدة البيانات: {e}")
             return False
     
-    def execute_query(self, query, params=None, fetch=True):
-        """تنفيذ استعلام SQL"""
+    def execute_query(self, query, params=None, fetch=True, name='execute_query'):
+        """تنفيذ استعلام SQL - name تسمية الاستعلام في المقاييس ومحلل الاستعلامات (اسم الدالة المستدعية)"""
         try:
-            conn = self.connect()
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(query, params)
-                if fetch:
-                    result = cur.fetchall()
-                    return result
-                else:
-                    conn.commit()
-                    return True
+            with self._connection() as conn:
+                with self._cursor(conn, name) as cur:
+                    cur.execute(query, params)
+                    result = cur.fetchall() if fetch else True
+                # commit أيضاً بعد القراءة حتى لا تبقى معاملة مفتوحة (ولحفظ INSERT ... RETURNING)
+                conn.commit()
+                return result
         except Exception as e:
             logger.error(f"خطأ في تنفيذ الاستعلام: {e}")
-            if self.conn:
-                self.conn.rollback()
             return None if fetch else False
     
+    def _cursor(self, conn, name, cursor_name=None):
+        """مؤشر يسجل زمن كل جملة في المقاييس ومحلل الاستعلامات باسم الدالة المستدعية"""
+        cur = conn.cursor(cursor_name, cursor_factory=ProfiledCursor)
+        cur.observer = functools.partial(self._observe, name)
+        return cur
+    
+    def _observe(self, name, query, params, elapsed, failed):
+        """تسجيل زمن جملة واحدة؛ الاستعلامات البطيئة المختارة تُحلل بـ EXPLAIN في الخلفية"""
+        QUERY_SECONDS.observe(elapsed, query=name)
+        if failed:
+            QUERY_ERRORS.inc(query=name)
+        if not self.profiler:
+            return
+        
+        # execute_values يمرر الجملة كاملة كـ bytes
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', errors='replace')
+        template = self.profiler.record(query, params, elapsed * 1000)
+        if template and self.profiler.should_explain(template):
+            self._explain_in_background(template, query, params)
+    
+    def _explain_in_background(self, template, query, params):
+        """EXPLAIN (ANALYZE, BUFFERS) يُعيد تنفيذ الاستعلام، لذا يعمل خارج مسار الطلب على اتصال مستقل"""
+        if self._explain_executor is None:
+            with self._pool_lock:
+                if self._explain_executor is None:
+                    self._explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query-explain')
+        
+        def explain():
+            try:
+                with self._dedicated_connection() as conn:
+                    self.profiler.explain(conn, template, query, params)
+            except Exception as e:
+                logger.error(f"خطأ في EXPLAIN للاستعلام البطيء: {e}")
+        
+        self._explain_executor.submit(explain)
+    
+    def query_profile(self, limit=20, order_by='total_ms'):
+        """أبطأ قوالب الاستعلامات (None إذا كان المحلل معطلاً)"""
+        if not self.profiler:
+            return None
+        return self.profiler.report(limit=limit, order_by=order_by)
+    
+    @contextmanager
+    def transaction(self, name='transaction'):
+        """تنفيذ عدة جمل في معاملة واحدة مع commit واحد (name كما في execute_query)"""
+        with self._connection() as conn:
+            with self._cursor(conn, name) as cur:
+                yield cur
+            conn.commit()
+    
     # ==================== المستخدمون ====================
     
     def get_user(self, user_id):
         """جلب معلومات مستخدم"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
         query = "SELECT * FROM users WHERE user_id = %s"
-        result = self.execute_query(query, (user_id,))
-        return result[0] if result else None
+        result = self.execute_query(query, (user_id,), name='get_user')
+        if not result:
+            return None
+        self.user_cache.set(user_id, dict(result[0]))
+        return result[0]
     
     def add_user(self, user_id, full_name, telegram_username=None, phone_number=None, 
                  email=None, role='user', department=None):
@@ -71,19 +443,37 @@ class Database:
         result = self.execute_query(
             query, 
             (user_id, full_name, telegram_username, phone_number, email, role, department),
-            fetch=True
+            fetch=True, name='add_user'
         )
+        self.user_cache.invalidate(user_id)
         return result[0]['user_id'] if result else None
     
+    def delete_user(self, user_id):
+        """حذف مستخدم (حذف منطقي)"""
+        query = "UPDATE users SET is_active = false WHERE user_id = %s"
+        result = self.execute_query(query, (user_id,), fetch=False, name='delete_user')
+        self.user_cache.invalidate(user_id)
+        return result
+    
     def update_user_activity(self, user_id):
-        """تحديث آخر نشاط للمستخدم"""
-        query = "UPDATE users SET last_active = NOW() WHERE user_id = %s"
-        return self.execute_query(query, (user_id,), fetch=False)
+        """تحديث آخر نشاط للمستخدم (والنسخة المخزنة مؤقتاً من الصف الجديد)"""
+        query = "UPDATE users SET last_active = NOW() WHERE user_id = %s RETURNING *"
+        result = self.execute_query(query, (user_id,), name='update_user_activity')
+        if result:
+            self.user_cache.set(user_id, dict(result[0]))
+        else:
+            self.user_cache.invalidate(user_id)
+        return result is not None
     
     # ==================== أنواع المعاملات ====================
     
     def get_transaction_types(self, level=None, parent_id=None):
         """جلب أنواع المعاملات"""
+        key = ('types', level, parent_id)
+        cached = self.type_cache.get(key)
+        if cached is not None:
+            return [dict(t) for t in cached]
+        
         if parent_id is not None:
             query = """
                 SELECT * FROM transaction_types 
@@ -106,13 +496,42 @@ class Database:
             """
             params = None
         
-        return self.execute_query(query, params) or []
+        result = self.execute_query(query, params, name='get_transaction_types')
+        if result is None:
+            return []
+        self.type_cache.set(key, [dict(t) for t in result])
+        return result
     
     def get_transaction_type_name(self, type_id):
         """جلب اسم نوع المعاملة"""
+        key = ('name', type_id)
+        name = self.type_cache.get(key)
+        if name is not None:
+            return name
         query = "SELECT name FROM transaction_types WHERE id = %s"
-        result = self.execute_query(query, (type_id,))
-        return result[0]['name'] if result else 'غير معروف'
+        result = self.execute_query(query, (type_id,), name='get_transaction_type_name')
+        if not result:
+            return 'غير معروف'
+        self.type_cache.set(key, result[0]['name'])
+        return result[0]['name']
+    
+    def add_transaction_type(self, name, icon=None, parent_id=None, level=1):
+        """إضافة نوع معاملة"""
+        query = """
+            INSERT INTO transaction_types (name, icon, parent_id, level, is_active)
+            VALUES (%s, %s, %s, %s, true)
+            RETURNING id
+        """
+        result = self.execute_query(query, (name, icon, parent_id, level), name='add_transaction_type')
+        self.type_cache.clear()
+        return result[0]['id'] if result else None
+    
+    def cache_stats(self):
+        """إحصائيات الذاكرة المؤقتة للمستخدمين وأنواع المعاملات"""
+        return {
+            'users': self.user_cache.stats(),
+            'transaction_types': self.type_cache.stats(),
+        }
     
     # ==================== المعاملات ====================
     
@@ -122,6 +541,8 @@ class Database:
         """إضافة معاملة جديدة"""
         if start_date is None:
             start_date = datetime.now().date()
+        if isinstance(data, dict):
+            data = Json(data)
         
         query = """
             INSERT INTO transactions (
@@ -133,19 +554,145 @@ class Database:
             RETURNING transaction_id
         """
         
-        result = self.execute_query(
-            query,
-            (transaction_type_id, user_id, responsible_person_id or user_id, 
-             title, description, data, start_date, end_date, priority),
-            fetch=True
-        )
-        
-        if result:
-            transaction_id = result[0]['transaction_id']
-            # إنشاء التنبيهات التلقائية
-            self.create_notifications_for_transaction(transaction_id, end_date, [user_id])
+        try:
+            # المعاملة وتنبيهاتها في معاملة قاعدة بيانات واحدة قصيرة
+            with self.transaction(name='add_transaction') as cur:
+                cur.execute(
+                    query,
+                    (transaction_type_id, user_id, responsible_person_id or user_id, 
+                     title, description, data, start_date, end_date, priority)
+                )
+                transaction_id = cur.fetchone()['transaction_id']
+                
+                # إنشاء التنبيهات التلقائية
+                self.create_notifications_for_transaction(
+                    transaction_id, end_date, [user_id],
+                    transaction_type_id=transaction_type_id, cursor=cur
+                )
+            self._transactions_written()
             return transaction_id
-        return None
+        except Exception as e:
+            logger.error(f"خطأ في إضافة المعاملة: {e}")
+            return None
+    
+    def add_transactions_bulk(self, items):
+        """إضافة دفعة معاملات وتنبيهاتها في معاملة قاعدة بيانات واحدة
+        
+        كل عنصر dict بمفاتيح add_transaction بالإضافة إلى idempotency_key اختياري.
+        العناصر بمفتاح مستخدم سابقاً لا تُضاف مرة أخرى. النتيجة قائمة بنفس ترتيب items:
+        {'transaction_id', 'idempotency_key', 'created'} (transaction_id = None مع 'error' لعنصر
+        تعذر تحديد معاملته) أو None عند فشل الدفعة (لا يُحفظ شيء).
+        """
+        if not self.has_schema('idempotency'):
+            logger.error("عمود idempotency_key أو فهرسه غير موجود: شغّل python migrations.py")
+            return None
+        
+        today = datetime.now().date()
+        results = [None] * len(items)
+        rows = []
+        first_index = {}
+        
+        for index, item in enumerate(items):
+            key = item.get('idempotency_key')
+            # المفتاح المكرر داخل نفس الدفعة يأخذ نتيجة أول عنصر
+            if key is not None:
+                if key in first_index:
+                    continue
+                first_index[key] = index
+            data = item.get('data')
+            rows.append((
+                index, item['transaction_type_id'], item['user_id'],
+                item.get('responsible_person_id') or item['user_id'],
+                item['title'], item.get('description', ''),
+                Json(data) if isinstance(data, dict) else data,
+                item.get('start_date') or today, item['end_date'],
+                item.get('priority', 'normal'), key
+            ))
+        
+        # ترتيب RETURNING غير مضمون، لذا يُحجز transaction_id لكل صف مسبقاً ويُعاد مع رقم العنصر (ord)
+        query = """
+            WITH input AS (
+                SELECT v.*, nextval(pg_get_serial_sequence('transactions', 'transaction_id')) AS transaction_id
+                FROM (VALUES %s) AS v(
+                    ord, transaction_type_id, user_id, responsible_person_id, title,
+                    description, data, start_date, end_date, priority, idempotency_key
+                )
+            ),
+            inserted AS (
+                INSERT INTO transactions (
+                    transaction_id, transaction_type_id, user_id, responsible_person_id, title, 
+                    description, data, start_date, end_date, priority, idempotency_key,
+                    status, is_active, created_at, updated_at
+                )
+                SELECT transaction_id, transaction_type_id, user_id, responsible_person_id, title,
+                       description, data, start_date, end_date, priority, idempotency_key,
+                       'active', true, NOW(), NOW()
+                FROM input
+                ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                RETURNING transaction_id
+            )
+            SELECT input.ord, input.transaction_id
+            FROM input
+            JOIN inserted USING (transaction_id)
+        """
+        template = "(%s, %s::integer, %s::bigint, %s::bigint, %s, %s, %s::jsonb, %s::date, %s::date, %s, %s)"
+        
+        try:
+            with self.transaction(name='add_transactions_bulk') as cur:
+                inserted = execute_values(cur, query, rows, template=template,
+                                          page_size=BULK_PAGE_SIZE, fetch=True)
+                
+                notification_rows = []
+                for row in inserted:
+                    index = row['ord']
+                    item = items[index]
+                    results[index] = {
+                        'transaction_id': row['transaction_id'],
+                        'idempotency_key': item.get('idempotency_key'),
+                        'created': True
+                    }
+                    notification_rows.extend(self._notification_rows(
+                        row['transaction_id'], item['end_date'], [item['user_id']],
+                        transaction_type_id=item['transaction_type_id'], today=today
+                    ))
+                if notification_rows:
+                    self._insert_notification_rows(cur, notification_rows)
+                
+                # مفاتيح موجودة مسبقاً: إرجاع المعاملة الأصلية
+                existing_keys = [k for k, index in first_index.items() if results[index] is None]
+                if existing_keys:
+                    cur.execute(
+                        "SELECT transaction_id, idempotency_key FROM transactions WHERE idempotency_key = ANY(%s)",
+                        (existing_keys,)
+                    )
+                    for row in cur.fetchall():
+                        results[first_index[row['idempotency_key']]] = {
+                            'transaction_id': row['transaction_id'],
+                            'idempotency_key': row['idempotency_key'],
+                            'created': False
+                        }
+        except Exception as e:
+            logger.error(f"خطأ في إضافة دفعة المعاملات: {e}")
+            return None
+        self._transactions_written()
+        
+        for index, item in enumerate(items):
+            if results[index] is not None:
+                continue
+            key = item.get('idempotency_key')
+            original = results[first_index[key]] if key in first_index else None
+            if original is not None and original['transaction_id'] is not None and first_index[key] != index:
+                results[index] = dict(original, created=False)
+            else:
+                # مثلاً مفتاح أُدرج في معاملة متزامنة ثم أُلغيت: العنصر فشل دون إيقاف بقية الدفعة
+                logger.error(f"تعذر تحديد المعاملة لعنصر الدفعة {index} (idempotency_key={key})")
+                results[index] = {
+                    'transaction_id': None,
+                    'idempotency_key': key,
+                    'created': False,
+                    'error': 'Transaction could not be resolved, retry the item'
+                }
+        return results
     
     def get_transaction(self, transaction_id):
         """جلب معلومات معاملة"""
@@ -159,7 +706,7 @@ class Database:
             LEFT JOIN users r ON t.responsible_person_id = r.user_id
             WHERE t.transaction_id = %s
         """
-        result = self.execute_query(query, (transaction_id,))
+        result = self.execute_query(query, (transaction_id,), name='get_transaction')
         return result[0] if result else None
     
     def get_user_transactions(self, user_id, status=None, transaction_type_id=None, 
@@ -190,7 +737,86 @@ class Database:
         if limit:
             query += f" LIMIT {limit}"
         
-        return self.execute_query(query, tuple(params)) or []
+        return self.execute_query(query, tuple(params), name='get_user_transactions') or []
+    
+    def get_active_transactions(self, user_id=None):
+        """جلب جميع المعاملات النشطة"""
+        query = ACTIVE_TRANSACTIONS_QUERY
+        params = []
+        
+        if user_id:
+            query += " AND t.user_id = %s"
+            params.append(user_id)
+        
+        query += " ORDER BY t.end_date, t.transaction_id"
+        return self.execute_query(query, tuple(params), name='get_active_transactions') or []
+    
+    def get_active_transactions_page(self, user_id=None, limit=None, cursor=None):
+        """جلب صفحة من المعاملات النشطة مرتبة حسب (end_date, transaction_id)، بدون end_date في النهاية
+        
+        يرجع (المعاملات، مؤشر الصفحة التالية أو None). يرفع ValueError إذا كان المؤشر غير صالح
+        وRuntimeError إذا فشل الاستعلام (بدلاً من صفحة فارغة تبدو كنهاية القائمة).
+        """
+        limit = clamp_limit(limit)
+        query = ACTIVE_TRANSACTIONS_QUERY
+        params = []
+        
+        if user_id:
+            query += " AND t.user_id = %s"
+            params.append(user_id)
+        
+        end_date, transaction_id = decode_cursor(cursor) if cursor else (None, None)
+        if not cursor:
+            query += " ORDER BY t.end_date, t.transaction_id LIMIT %s"
+            params.append(limit + 1)
+        elif end_date is None:
+            # داخل قسم المعاملات بدون end_date
+            query += " AND t.end_date IS NULL AND t.transaction_id > %s ORDER BY t.transaction_id LIMIT %s"
+            params += [transaction_id, limit + 1]
+        else:
+            # بقية المعاملات المؤرخة ثم قسم NULL؛ كل فرع يستخدم الفهرس بترتيبه
+            query = f"""
+                SELECT * FROM (
+                    ({query} AND (t.end_date, t.transaction_id) > (%s, %s)
+                     ORDER BY t.end_date, t.transaction_id LIMIT %s)
+                    UNION ALL
+                    ({query} AND t.end_date IS NULL ORDER BY t.transaction_id LIMIT %s)
+                ) page
+                ORDER BY end_date NULLS LAST, transaction_id
+                LIMIT %s
+            """
+            params = params + [end_date, transaction_id, limit + 1] + params + [limit + 1, limit + 1]
+        
+        rows = self.execute_query(query, tuple(params), name='get_active_transactions_page')
+        if rows is None:
+            raise RuntimeError('Failed to load transactions page')
+        return build_page(rows, limit)
+    
+    def iter_transaction_chunks(self, chunk_size=EXPORT_CHUNK_SIZE, include_inactive=False):
+        """قراءة جميع المعاملات على دفعات عبر server-side cursor دون تحميل الجدول في الذاكرة"""
+        query = """
+            SELECT t.*, tt.name as type_name
+            FROM transactions t
+            LEFT JOIN transaction_types tt ON t.transaction_type_id = tt.id
+        """
+        if not include_inactive:
+            query += " WHERE t.is_active = true"
+        query += " ORDER BY t.transaction_id"
+        
+        with self._dedicated_connection() as conn:
+            try:
+                with self._cursor(conn, 'iter_transaction_chunks', f"export_{uuid.uuid4().hex}") as cur:
+                    cur.itersize = chunk_size
+                    cur.execute(query)
+                    while True:
+                        rows = cur.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        yield rows
+            finally:
+                # إنهاء معاملة القراءة حتى لو توقف المستهلك في المنتصف
+                if not conn.closed:
+                    conn.rollback()
     
     def get_recent_transactions(self, limit=10):
         """جلب أحدث المعاملات"""
@@ -203,19 +829,22 @@ class Database:
             ORDER BY t.created_at DESC
             LIMIT %s
         """
-        return self.execute_query(query, (limit,)) or []
+        return self.execute_query(query, (limit,), name='get_recent_transactions') or []
     
     def update_transaction(self, transaction_id, updates):
         """تحديث معاملة"""
         # بناء جملة UPDATE ديناميكياً
         set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
+        # موعد التنبيهات غير المرسلة يُعاد حسابه عند تغيير end_date (trigger transactions_end_date_fire_at)
         query = f"""
             UPDATE transactions 
             SET {set_clause}, updated_at = NOW()
             WHERE transaction_id = %s
         """
         params = list(updates.values()) + [transaction_id]
-        return self.execute_query(query, tuple(params), fetch=False)
+        result = self.execute_query(query, tuple(params), fetch=False, name='update_transaction')
+        self._transactions_written()
+        return result
     
     def delete_transaction(self, transaction_id):
         """حذف معاملة (soft delete)"""
@@ -224,10 +853,22 @@ class Database:
             SET is_active = false, updated_at = NOW()
             WHERE transaction_id = %s
         """
-        return self.execute_query(query, (transaction_id,), fetch=False)
+        result = self.execute_query(query, (transaction_id,), fetch=False, name='delete_transaction')
+        self._transactions_written()
+        return result
     
-    def search_transactions(self, user_id, search_term):
-        """البحث في المعاملات"""
+    def search_transactions(self, user_id, search_term, mode=None):
+        """البحث في المعاملات
+
+        mode='indexed' يوحد النص العربي ويبحث في العنوان والوصف وdata عبر فهرس trigram
+        مع ترتيب النتائج حسب التشابه، وmode='ilike' هو البحث القديم في العنوان والوصف
+        """
+        if (mode or SEARCH_MODE) == 'indexed':
+            results = self._search_transactions_indexed(user_id, search_term)
+            if results is not None:
+                return results
+            logger.warning("البحث المفهرس غير متاح، سيتم استخدام ILIKE")
+        
         query = """
             SELECT t.*, tt.name as type_name, tt.icon
             FROM transactions t
@@ -238,7 +879,29 @@ class Database:
             ORDER BY t.end_date ASC
         """
         search_pattern = f"%{search_term}%"
-        return self.execute_query(query, (user_id, search_pattern, search_pattern)) or []
+        return self.execute_query(query, (user_id, search_pattern, search_pattern), name='search_transactions') or []
+    
+    def _search_transactions_indexed(self, user_id, search_term):
+        """بحث مفهرس: تطابق جزئي أو تشابه كلمات (<%) على المستند الموحد - None عند الخطأ"""
+        term = normalize_arabic(search_term).strip()
+        if not term:
+            return []
+        # بدون فهرس trigram يصبح البحث مسحاً كاملاً للجدول مع توحيد كل صف
+        if not self.has_schema('search_index'):
+            return None
+        document = search_document_sql('t')
+        query = f"""
+            SELECT t.*, tt.name as type_name, tt.icon,
+                   word_similarity(%(term)s, {document}) as rank
+            FROM transactions t
+            LEFT JOIN transaction_types tt ON t.transaction_type_id = tt.id
+            WHERE t.user_id = %(user_id)s
+            AND t.is_active = true
+            AND ({document} LIKE %(pattern)s OR %(term)s <%% {document})
+            ORDER BY rank DESC, t.end_date ASC
+        """
+        params = {'user_id': user_id, 'term': term, 'pattern': f"%{escape_like(term)}%"}
+        return self.execute_query(query, params, name='_search_transactions_indexed')
     
     def get_transactions_due_soon(self, user_id, days=7):
         """جلب المعاملات التي تنتهي قريباً"""
@@ -253,65 +916,146 @@ class Database:
             ORDER BY t.end_date ASC
         """
         due_date = datetime.now().date() + timedelta(days=days)
-        return self.execute_query(query, (user_id, due_date)) or []
+        return self.execute_query(query, (user_id, due_date), name='get_transactions_due_soon') or []
+    
+    def _transactions_written(self):
+        with self._write_version_lock:
+            self.transactions_write_version += 1
+    
+    def get_transactions_version(self):
+        """وقت آخر كتابة على المعاملات (الحذف منطقي ويحدّث updated_at) - None عند الخطأ"""
+        result = self.execute_query("SELECT MAX(updated_at) AS version FROM transactions", name='get_transactions_version')
+        return result[0]['version'] if result else None
+    
+    def get_urgency_buckets(self, user_id=None, critical_days=URGENCY_CRITICAL_DAYS,
+                            warning_days=URGENCY_WARNING_DAYS):
+        """عدد المعاملات النشطة حسب الأيام المتبقية (عاجلة/تحذير/آمنة) في استعلام واحد"""
+        query = """
+            SELECT COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE end_date - CURRENT_DATE <= %(critical)s) AS critical,
+                   COUNT(*) FILTER (
+                       WHERE end_date - CURRENT_DATE > %(critical)s
+                       AND end_date - CURRENT_DATE <= %(warning)s
+                   ) AS warning,
+                   COUNT(*) FILTER (
+                       WHERE end_date IS NULL OR end_date - CURRENT_DATE > %(warning)s
+                   ) AS safe
+            FROM transactions
+            WHERE is_active = true
+        """
+        params = {'critical': critical_days, 'warning': warning_days}
+        if user_id is not None:
+            query += " AND user_id = %(user_id)s"
+            params['user_id'] = user_id
+        result = self.execute_query(query, params, name='get_urgency_buckets')
+        if result:
+            return dict(result[0])
+        return dict.fromkeys(('total', 'critical', 'warning', 'safe'), 0)
     
     # ==================== التنبيهات ====================
     
-    def create_notifications_for_transaction(self, transaction_id, end_date, recipients):
+    def get_reminder_offsets(self, transaction_type_id=None):
+        """مواعيد التذكير (أيام قبل الانتهاء) لنوع المعاملة"""
+        return self.reminder_offsets.get(transaction_type_id, DEFAULT_REMINDER_OFFSETS)
+    
+    def create_notifications_for_transaction(self, transaction_id, end_date, recipients,
+                                             transaction_type_id=None, cursor=None):
         """إنشاء التنبيهات التلقائية لمعاملة"""
-        days_before_list = [30, 15, 7, 3, 0]
+        rows = self._notification_rows(transaction_id, end_date, recipients, transaction_type_id)
+        if not rows:
+            return True
         
-        for days_before in days_before_list:
+        if cursor is not None:
+            self._insert_notification_rows(cursor, rows)
+            return True
+        
+        try:
+            with self.transaction(name='create_notifications_for_transaction') as cur:
+                self._insert_notification_rows(cur, rows)
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في إنشاء التنبيهات: {e}")
+            return False
+    
+    def _notification_rows(self, transaction_id, end_date, recipients, transaction_type_id=None, today=None):
+        """صفوف التنبيهات المستقبلية لمعاملة حسب مواعيد التذكير لنوعها"""
+        if isinstance(end_date, str):
+            end_date = date.fromisoformat(end_date)
+        today = today or datetime.now().date()
+        
+        rows = []
+        for days_before in self.get_reminder_offsets(transaction_type_id):
             notification_date = end_date - timedelta(days=days_before)
             
             # تخطي التنبيهات في الماضي
-            if notification_date < datetime.now().date():
+            if notification_date < today:
                 continue
             
-            query = """
-                INSERT INTO notifications (
-                    transaction_id, days_before, recipients, 
-                    notification_type, message, sent, created_at
-                )
-                VALUES (%s, %s, %s, 'scheduled', %s, false, NOW())
-            """
-            
             # إنشاء رسالة التنبيه
             if days_before == 0:
                 message = f"⏰ تنتهي المعاملة اليوم!"
             else:
                 message = f"⚠️ تنبيه: المعاملة ستنتهي بعد {days_before} يوم"
             
-            self.execute_query(
-                query,
-                (transaction_id, days_before, recipients, message),
-                fetch=False
-            )
+            rows.append((transaction_id, days_before, recipients, message, notification_date))
+        return rows
     
-    def get_pending_notifications(self):
-        """جلب التنبيهات المعلقة (التي يجب إرسالها اليوم)"""
-        query = """
+    def _insert_notification_rows(self, cur, rows):
+        """إدراج صفوف التنبيهات بجملة INSERT متعددة الصفوف"""
+        if not self.has_schema('fire_at_column'):
+            # مخطط ما قبل الترحيل: بدون fire_at
+            rows = [row[:-1] for row in rows]
+            query = """
+                INSERT INTO notifications (
+                    transaction_id, days_before, recipients, 
+                    notification_type, message, sent, created_at
+                )
+                VALUES %s
+            """
+            template = "(%s, %s, %s, 'scheduled', %s, false, NOW())"
+        else:
+            query = """
+                INSERT INTO notifications (
+                    transaction_id, days_before, recipients, 
+                    notification_type, message, sent, fire_at, created_at
+                )
+                VALUES %s
+            """
+            template = "(%s, %s, %s, 'scheduled', %s, false, %s, NOW())"
+        execute_values(cur, query, rows, template=template, page_size=BULK_PAGE_SIZE)
+    
+    def get_pending_notifications(self, lookback_days=NOTIFICATION_LOOKBACK_DAYS):
+        """جلب التنبيهات المعلقة: موعدها اليوم، أو خلال lookback_days الماضية ولم تكتمل بعد
+        (فشل مؤقت لبعض المستلمين أو دورة لم تعمل) حتى لا تسقط بتغير التاريخ"""
+        # بدون fire_at وtriggers وفهرسه (قبل الترحيل) يُحسب الموعد من end_date وقت الاستعلام
+        fire_at = 'n.fire_at' if self.has_schema('fire_at') else '(t.end_date - n.days_before)'
+        query = f"""
             SELECT n.*, t.title, t.end_date, t.priority, tt.name as type_name
             FROM notifications n
             JOIN transactions t ON n.transaction_id = t.transaction_id
             JOIN transaction_types tt ON t.transaction_type_id = tt.id
             WHERE n.sent = false
+            AND {fire_at} <= CURRENT_DATE
+            AND {fire_at} >= CURRENT_DATE - %s
             AND t.is_active = true
             AND t.status = 'active'
-            AND (t.end_date - n.days_before) = CURRENT_DATE
-            ORDER BY n.created_at ASC
+            ORDER BY {fire_at} ASC, n.created_at ASC
         """
-        results = self.execute_query(query) or []
+        results = self.execute_query(query, (lookback_days,), name='get_pending_notifications') or []
         
         # تحديث رسالة التنبيه بالتفاصيل
+        today = datetime.now().date()
         for notif in results:
             priority_emoji = {'normal': '🟢', 'high': '🟡', 'critical': '🔴'}
-            days = notif['days_before']
+            # الأيام المتبقية فعلياً (التنبيه المتأخر من يوم سابق لا يطابق days_before)
+            days = (notif['end_date'] - today).days if notif['end_date'] else notif['days_before']
             
             if days == 0:
-                time_text = "**اليوم**"
+                time_text = "تنتهي **اليوم**"
+            elif days < 0:
+                time_text = f"انتهت منذ **{-days}** يوم"
             else:
-                time_text = f"بعد **{days}** يوم"
+                time_text = f"تنتهي بعد **{days}** يوم"
             
             notif['message'] = f"""
 🔔 **تنبيه معاملة**
@@ -320,7 +1064,7 @@ class Database:
 📂 النوع: {notif['type_name']}
 {priority_emoji.get(notif['priority'], '')} الأولوية: {notif['priority']}
 
-⏰ تنتهي {time_text}
+⏰ {time_text}
 📅 تاريخ الانتهاء: {notif['end_date']}
 
 🆔 رقم المعاملة: #{notif['transaction_id']}
@@ -335,88 +1079,203 @@ class Database:
             SET sent = true, sent_at = NOW()
             WHERE notification_id = %s
         """
-        return self.execute_query(query, (notification_id,), fetch=False)
+        return self.execute_query(query, (notification_id,), fetch=False, name='mark_notification_sent')
+    
+    def mark_notifications_sent(self, acks):
+        """تعليم دفعة تنبيهات كمُرسلة بجملة واحدة - acks: [(notification_id, sent_at), ...]"""
+        acks = list(acks)
+        if not acks:
+            return True
+        
+        query = """
+            UPDATE notifications n
+            SET sent = true, sent_at = v.sent_at
+            FROM (VALUES %s) AS v(notification_id, sent_at)
+            WHERE n.notification_id = v.notification_id
+        """
+        try:
+            with self.transaction(name='mark_notifications_sent') as cur:
+                execute_values(cur, query, acks, template="(%s, %s::timestamp)", page_size=len(acks))
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في تحديث حالة التنبيهات: {e}")
+            return False
+    
+    def record_notification_deliveries(self, deliveries):
+        """حفظ نتائج المستلمين لتنبيهات لم تكتمل
+        
+        deliveries: [(notification_id, [من استلم], [من فشل نهائياً]), ...]
+        """
+        # UPDATE ... FROM يطبق صفاً واحداً فقط من VALUES لكل تنبيه، لذا تُدمج الإدخالات المتعددة أولاً
+        merged = {}
+        for notification_id, delivered, failed in deliveries:
+            entry = merged.setdefault(notification_id, (set(), set()))
+            entry[0].update(delivered)
+            entry[1].update(failed)
+        if not merged:
+            return True
+        if not self.has_schema('deliveries'):
+            # لا يمكن حفظ المستلمين: يُعاد الإرسال لكل المستلمين كما قبل الترحيل
+            logger.error("عمودا delivered_to/failed_to غير موجودين: شغّل python migrations.py")
+            return True
+        deliveries = [
+            (notification_id, sorted(delivered), sorted(failed))
+            for notification_id, (delivered, failed) in merged.items()
+        ]
+        
+        query = """
+            UPDATE notifications n
+            SET delivered_to = ARRAY(SELECT DISTINCT unnest(n.delivered_to || v.delivered)),
+                failed_to = ARRAY(SELECT DISTINCT unnest(n.failed_to || v.failed))
+            FROM (VALUES %s) AS v(notification_id, delivered, failed)
+            WHERE n.notification_id = v.notification_id
+        """
+        try:
+            with self.transaction(name='record_notification_deliveries') as cur:
+                execute_values(cur, query, deliveries, template="(%s, %s::bigint[], %s::bigint[])",
+                               page_size=len(deliveries))
+            return True
+        except Exception as e:
+            logger.error(f"خطأ في حفظ مستلمي التنبيهات: {e}")
+            return False
     
     # ==================== الإحصائيات ====================
     
     def get_statistics(self):
-        """جلب الإحصائيات العامة"""
-        stats = {}
+        """جلب الإحصائيات العامة (مجموع صفوف العدادات التراكمية)
         
-        # إجمالي المعاملات
-        query = "SELECT COUNT(*) as count FROM transactions WHERE is_active = true"
-        result = self.execute_query(query)
-        stats['total_transactions'] = result[0]['count'] if result else 0
+        العدادات صحيحة فقط إذا كانت كل triggers موجودة وحُسبت مرة واحدة على الأقل، وإلا تُحسب
+        بـ COUNT(*) مباشرة. إذا مضى أكثر من STATISTICS_RECONCILE_INTERVAL_HOURS على آخر إعادة حساب
+        تُعاد في الخلفية، فيصحح أي انحراف كل عملية تعرض الإحصائيات (وليس نظام التنبيهات فقط).
+        """
+        columns = [c for counters in STATISTICS_COUNTERS.values() for c in counters]
+        query = f"""
+            SELECT {_statistics_totals_sql()},
+                   MIN(reconciled_at) AS reconciled_at,
+                   MIN(reconciled_at) < NOW() - make_interval(hours => %(interval)s) AS reconcile_due,
+                   (
+                       SELECT COUNT(*) FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid
+                       WHERE t.tgname = ANY(%(triggers)s) AND NOT t.tgisinternal
+                       AND c.relnamespace = current_schema()::regnamespace
+                   ) AS triggers
+            FROM statistics_counters
+        """
+        result = self.execute_query(query, {
+            'interval': STATISTICS_RECONCILE_INTERVAL_HOURS,
+            'triggers': STATISTICS_TRIGGERS,
+        }, name='get_statistics')
         
-        # المعاملات النشطة
-        query = "SELECT COUNT(*) as count FROM transactions WHERE status = 'active' AND is_active = true"
-        result = self.execute_query(query)
-        stats['active_transactions'] = result[0]['count'] if result else 0
+        if result and result[0]['reconciled_at'] is not None and result[0]['triggers'] == len(STATISTICS_TRIGGERS):
+            if result[0]['reconcile_due']:
+                self._reconcile_statistics_in_background()
+            return {c: result[0][c] for c in columns}
         
-        # عدد المستخدمين
-        query = "SELECT COUNT(*) as count FROM users WHERE is_active = true"
-        result = self.execute_query(query)
-        stats['total_users'] = result[0]['count'] if result else 0
+        logger.warning("عدادات الإحصائيات غير جاهزة (triggers أو صفوف مفقودة)، سيتم العد مباشرة")
+        result = self.execute_query(_statistics_count_sql(), name='get_statistics')
+        if result:
+            return dict(result[0])
+        raise RuntimeError('Failed to load statistics')
+    
+    def _reconcile_statistics_in_background(self):
+        """إعادة حساب واحدة على الأكثر في نفس الوقت لكل عملية"""
+        if not self._reconcile_lock.acquire(blocking=False):
+            return
         
-        # التنبيهات المعلقة
-        query = "SELECT COUNT(*) as count FROM notifications WHERE sent = false"
-        result = self.execute_query(query)
-        stats['pending_notifications'] = result[0]['count'] if result else 0
+        def reconcile():
+            try:
+                self.reconcile_statistics()
+            finally:
+                self._reconcile_lock.release()
         
-        return stats
+        threading.Thread(target=reconcile, name='statistics-reconcile', daemon=True).start()
+    
+    def reconcile_statistics(self):
+        """إعادة حساب العدادات التراكمية لتصحيح أي انحراف"""
+        try:
+            with self.transaction(name='reconcile_statistics') as cur:
+                before, after = _reconcile_statistics(cur)
+            
+            drift = {
+                c: after[c] - before[c]
+                for counters in STATISTICS_COUNTERS.values() for c in counters
+                if before and after[c] != before[c]
+            }
+            if drift:
+                logger.warning(f"تم تصحيح انحراف في العدادات: {drift}")
+            return drift
+        except Exception as e:
+            logger.error(f"خطأ في إعادة حساب العدادات: {e}")
+            return None
     
     def get_user_statistics(self, user_id):
         """جلب إحصائيات مستخدم محدد"""
-        stats = {}
-        
-        # إجمالي المعاملات
-        query = "SELECT COUNT(*) as count FROM transactions WHERE user_id = %s AND is_active = true"
-        result = self.execute_query(query, (user_id,))
-        stats['total_transactions'] = result[0]['count'] if result else 0
-        
-        # المعاملات حسب الحالة
-        for status in ['active', 'completed', 'cancelled']:
-            query = """
-                SELECT COUNT(*) as count FROM transactions 
-                WHERE user_id = %s AND status = %s AND is_active = true
-            """
-            result = self.execute_query(query, (user_id, status))
-            stats[f'{status}_transactions'] = result[0]['count'] if result else 0
-        
-        # المعاملات حسب الأولوية
-        for priority in ['normal', 'high', 'critical']:
-            query = """
-                SELECT COUNT(*) as count FROM transactions 
-                WHERE user_id = %s AND priority = %s AND status = 'active' AND is_active = true
-            """
-            result = self.execute_query(query, (user_id, priority))
-            key = 'normal_transactions' if priority == 'normal' else f'{priority}_priority_transactions'
-            stats[key] = result[0]['count'] if result else 0
+        return self.get_users_statistics([user_id])[user_id]
+    
+    def get_users_statistics(self, user_ids):
+        """جلب إحصائيات عدة مستخدمين باستعلام واحد - يرجع {user_id: stats}"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
         
-        # المعاملات التي تنتهي قريباً (7 أيام)
+        # عدّ شرطي (FILTER) بدلاً من استعلام COUNT منفصل لكل رقم
         query = """
-            SELECT COUNT(*) as count FROM transactions 
-            WHERE user_id = %s AND status = 'active' 
-            AND is_active = true
-            AND end_date <= %s
+            WITH ids AS (
+                SELECT DISTINCT unnest(%(user_ids)s::bigint[]) AS user_id
+            ),
+            tx AS (
+                SELECT user_id,
+                       COUNT(*) AS total_transactions,
+                       COUNT(*) FILTER (WHERE status = 'active') AS active_transactions,
+                       COUNT(*) FILTER (WHERE status = 'completed') AS completed_transactions,
+                       COUNT(*) FILTER (WHERE status = 'cancelled') AS cancelled_transactions,
+                       COUNT(*) FILTER (WHERE status = 'active' AND priority = 'normal') AS normal_transactions,
+                       COUNT(*) FILTER (WHERE status = 'active' AND priority = 'high') AS high_priority_transactions,
+                       COUNT(*) FILTER (WHERE status = 'active' AND priority = 'critical') AS critical_priority_transactions,
+                       COUNT(*) FILTER (WHERE status = 'active' AND end_date <= %(due_date)s) AS due_soon
+                FROM transactions
+                WHERE user_id = ANY(%(user_ids)s) AND is_active = true
+                GROUP BY user_id
+            ),
+            pn AS (
+                SELECT t.user_id, COUNT(*) AS pending_notifications
+                FROM notifications n
+                JOIN transactions t ON n.transaction_id = t.transaction_id
+                WHERE t.user_id = ANY(%(user_ids)s) AND n.sent = false
+                GROUP BY t.user_id
+            )
+            SELECT ids.user_id,
+                   COALESCE(tx.total_transactions, 0) AS total_transactions,
+                   COALESCE(tx.active_transactions, 0) AS active_transactions,
+                   COALESCE(tx.completed_transactions, 0) AS completed_transactions,
+                   COALESCE(tx.cancelled_transactions, 0) AS cancelled_transactions,
+                   COALESCE(tx.normal_transactions, 0) AS normal_transactions,
+                   COALESCE(tx.high_priority_transactions, 0) AS high_priority_transactions,
+                   COALESCE(tx.critical_priority_transactions, 0) AS critical_priority_transactions,
+                   COALESCE(tx.due_soon, 0) AS due_soon,
+                   COALESCE(pn.pending_notifications, 0) AS pending_notifications
+            FROM ids
+            LEFT JOIN tx ON tx.user_id = ids.user_id
+            LEFT JOIN pn ON pn.user_id = ids.user_id
         """
         due_date = datetime.now().date() + timedelta(days=7)
-        result = self.execute_query(query, (user_id, due_date))
-        stats['due_soon'] = result[0]['count'] if result else 0
+        result = self.execute_query(query, {'user_ids': user_ids, 'due_date': due_date}, name='get_users_statistics') or []
         
-        # التنبيهات المعلقة
-        query = """
-            SELECT COUNT(*) as count FROM notifications n
-            JOIN transactions t ON n.transaction_id = t.transaction_id
-            WHERE t.user_id = %s AND n.sent = false
-        """
-        result = self.execute_query(query, (user_id,))
-        stats['pending_notifications'] = result[0]['count'] if result else 0
+        stats = {row['user_id']: {k: v for k, v in row.items() if k != 'user_id'} for row in result}
         
+        # المستخدمون الذين تعذر جلب إحصائياتهم يحصلون على أصفار كما في السابق
+        for user_id in user_ids:
+            stats.setdefault(user_id, dict.fromkeys(USER_STATISTICS_KEYS, 0))
         return stats
     
     def close(self):
         """إغلاق الاتصال بقاعدة البيانات"""
+        if self._explain_executor:
+            self._explain_executor.shutdown(wait=False)
+            self._explain_executor = None
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+            logger.info("تم إغلاق مجمع الاتصالات")
         if self.conn and not self.conn.closed:
             self.conn.close()
             logger.info("تم إغلاق الاتصال بقاعدة البيانات")
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """لم يتوفر اتصال في المجمع خلال المهلة المحددة"""
+
+
+class ConnectionPool:
+    """مجمع اتصالات PostgreSQL آمن للاستخدام من عدة Threads مع فحص صحة الاتصالات"""
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=30, health_check_after=30):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._pool = ThreadedConnectionPool(minconn, maxconn, dsn)
+        # ThreadedConnectionPool يرفع خطأ فوراً عند الامتلاء، لذا ننتظر على semaphore
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'in_use': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def getconn(self):
+        """استعارة اتصال سليم من المجمع"""
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        try:
+            conn = self._healthy_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_time_total'] += time.monotonic() - started
+        return conn
+
+    def _healthy_connection(self):
+        """إرجاع اتصال من المجمع بعد استبدال الاتصالات المغلقة أو المعطلة"""
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if not conn.closed and self._is_alive(conn):
+                return conn
+            self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    def _is_alive(self, conn):
+        """فحص الاتصال بـ SELECT 1 إذا ظل خاملاً لفترة طويلة"""
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_after:
+            return True
+
+        self._count('health_checks')
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"اتصال معطل في المجمع، سيتم استبداله: {e}")
+            return False
+
+    def _discard(self, conn):
+        self._count('discarded')
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def putconn(self, conn, close=False):
+        """إعادة اتصال إلى المجمع"""
+        try:
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                # يقوم المجمع بعمل rollback لأي معاملة مفتوحة قبل إعادة استخدام الاتصال
+                self._pool.putconn(conn)
+        finally:
+            self._count('in_use', -1)
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """استعارة اتصال لمدة كتلة with ثم إعادته"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def stats(self):
+        """إحصائيات المجمع"""
+        with self._lock:
+            stats = dict(self._stats)
+        wait_total = stats.pop('wait_time_total')
+        stats.update({
+            'minconn': self.minconn,
+            'maxconn': self.maxconn,
+            'avg_checkout_ms': round(wait_total / stats['checkouts'] * 1000, 3) if stats['checkouts'] else 0.0,
+        })
+        return stats
+
+    def close(self):
+        """إغلاق جميع الاتصالات"""
+        self._pool.closeall()
+        self._last_used.clear()
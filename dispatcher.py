@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_CYCLES = counter('notification_dispatch_cycles_total', 'Notification dispatch cycles')
+DISPATCH_CYCLE_SECONDS = histogram(
+    'notification_dispatch_cycle_seconds', 'Duration of a notification dispatch cycle',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800)
+)
+SEND_SECONDS = histogram('notification_send_seconds', 'Latency of a single Telegram send_message call')
+MESSAGES = counter('notification_messages_total', 'Notification messages by outcome', ('outcome',))
+RATE_LIMITED = counter('notification_rate_limited_total', 'Telegram 429 (RetryAfter) responses')
+
+# الحد الأقصى لطول رسالة تيليجرام
+TELEGRAM_MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n━━━━━━━━━━━━━━\n"
+
+# ترتيب النتائج من الأفضل للأسوأ (الفشل المؤقت يعني إعادة المحاولة)
+OUTCOME_SEVERITY = ('sent', 'failed', 'transient')
+
+
+class NotificationDispatcher:
+    """إرسال التنبيهات بشكل متوازٍ على حلقة asyncio واحدة طويلة العمر"""
+
+    SENT = 'sent'
+    FAILED = 'failed'
+    TRANSIENT = 'transient'
+
+    def __init__(self, bot, database, event_loop, concurrency=20, rate_governor=None,
+                 max_retries=3, ack_batch_size=100, digest_mode=False):
+        self.bot = bot
+        self.db = database
+        self.event_loop = event_loop
+        self.concurrency = concurrency
+        self.rate_governor = rate_governor
+        self.max_retries = max_retries
+        self.ack_batch_size = ack_batch_size
+        self.digest_mode = digest_mode
+        self.last_cycle = None
+        self._rate_limited = 0
+        self._acks = []
+        self._deliveries = []
+
+    def dispatch(self, notifications):
+        """إرسال دفعة تنبيهات من Thread متزامن (مثل الـ Scheduler)"""
+        return self.event_loop.run(self.dispatch_async(notifications))
+
+    async def dispatch_async(self, notifications):
+        """إرسال جميع التنبيهات لجميع المستلمين بالتوازي"""
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self._rate_limited = 0
+
+        # عدم إعادة الإرسال لمن استلم فعلاً (بما فيه ما فشل حفظه في الدورة السابقة) ثم إعادة حفظه
+        notifications = self._pending(notifications)
+        await self._flush_acks()
+
+        if self.digest_mode:
+            results = await self._send_digests(notifications, semaphore)
+        else:
+            results = await asyncio.gather(*[
+                self._send_notification(notification, semaphore)
+                for notification in notifications
+            ])
+        await self._flush_acks()
+
+        elapsed = time.monotonic() - started
+        sent = sum(ok for ok, _ in results)
+        failed = sum(bad for _, bad in results)
+        DISPATCH_CYCLES.inc()
+        DISPATCH_CYCLE_SECONDS.observe(elapsed)
+
+        self.last_cycle = {
+            'notifications': len(notifications),
+            'messages_sent': sent,
+            'messages_failed': failed,
+            'rate_limited': self._rate_limited,
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(sent / elapsed, 2) if elapsed > 0 else 0.0
+        }
+        logger.info(
+            f"📊 Dispatch cycle: {len(notifications)} notifications, "
+            f"{sent} sent, {failed} failed, {self._rate_limited} rate-limited in {elapsed:.2f}s "
+            f"({self.last_cycle['messages_per_second']} msg/s)"
+        )
+        return self.last_cycle
+
+    def _pending(self, notifications):
+        """التنبيهات مع المستلمين الذين لم يُحسم أمرهم بعد (delivered_to وfailed_to وما لم يُحفظ بعد)"""
+        acked = {notification_id for notification_id, _ in self._acks}
+        delivered = {}
+        for notification_id, user_ids, failed_ids in self._deliveries:
+            delivered.setdefault(notification_id, set()).update(user_ids, failed_ids)
+
+        pending = []
+        for notification in notifications:
+            notification_id = notification['notification_id']
+            if notification_id in acked:
+                continue
+            done = (
+                set(notification.get('delivered_to') or [])
+                | set(notification.get('failed_to') or [])
+                | delivered.get(notification_id, set())
+            )
+            pending.append(dict(
+                notification,
+                recipients=[user_id for user_id in notification['recipients'] or [] if user_id not in done]
+            ))
+        return pending
+
+    async def _send_notification(self, notification, semaphore):
+        """إرسال تنبيه واحد لكل مستلميه ثم تسجيل نتيجة كل مستلم"""
+        notification_id = notification['notification_id']
+        recipients = notification['recipients']
+
+        outcomes = await asyncio.gather(*[
+            self._send_message(notification_id, user_id, notification['message'], semaphore)
+            for user_id in recipients
+        ])
+        await self._acknowledge(notification_id, dict(zip(recipients, outcomes)))
+
+        sent = outcomes.count(self.SENT)
+        return sent, len(outcomes) - sent
+
+    async def _send_digests(self, notifications, semaphore):
+        """تجميع التنبيهات حسب المستلم وإرسال رسالة ملخص واحدة لكل مستخدم"""
+        by_recipient = {}
+        for notification in notifications:
+            for user_id in notification['recipients']:
+                by_recipient.setdefault(user_id, []).append(notification)
+
+        user_ids = list(by_recipient)
+        digests = await asyncio.gather(*[
+            self._send_digest(user_id, by_recipient[user_id], semaphore)
+            for user_id in user_ids
+        ])
+
+        # نتيجة كل تنبيه لكل مستلم حسب أجزاء الملخص التي تحمله فقط
+        for notification in notifications:
+            notification_id = notification['notification_id']
+            await self._acknowledge(notification_id, {
+                user_id: outcome_by_notification[notification_id]
+                for user_id, (outcome_by_notification, _) in zip(user_ids, digests)
+                if notification_id in outcome_by_notification
+            })
+
+        return [
+            (chunk_outcomes.count(self.SENT), len(chunk_outcomes) - chunk_outcomes.count(self.SENT))
+            for _, chunk_outcomes in digests
+        ]
+
+    async def _send_digest(self, user_id, notifications, semaphore):
+        """إرسال ملخص مستخدم واحد (مقسماً على عدة رسائل إذا تجاوز حد تيليجرام)
+
+        يرجع (نتيجة كل تنبيه، نتائج الأجزاء). التنبيه الموزع على عدة أجزاء يأخذ أسوأ نتيجة بينها.
+        """
+        header = f"📬 ملخص التنبيهات ({len(notifications)})"
+        chunks = pack_message(
+            [header] + [notification['message'].strip() for notification in notifications]
+        )
+
+        outcome_by_notification = {}
+        chunk_outcomes = []
+        for chunk, part_indices in chunks:
+            # أجزاء الملخص الواحد تُرسل بالترتيب
+            outcome = await self._send_message('digest', user_id, chunk, semaphore)
+            chunk_outcomes.append(outcome)
+            for index in part_indices:
+                # الجزء 0 هو العنوان
+                if index == 0:
+                    continue
+                notification_id = notifications[index - 1]['notification_id']
+                previous = outcome_by_notification.get(notification_id, self.SENT)
+                outcome_by_notification[notification_id] = max(
+                    previous, outcome, key=OUTCOME_SEVERITY.index
+                )
+        return outcome_by_notification, chunk_outcomes
+
+    async def _acknowledge(self, notification_id, outcomes):
+        """تسجيل نتيجة تنبيه: يُعلَّم كمُرسل إذا لم يبقَ فشل مؤقت، وإلا يُحفظ من استلمه ومن فشل نهائياً
+
+        outcomes: {user_id: SENT / FAILED / TRANSIENT} للمستلمين المتبقين في هذه الدورة
+        """
+        if self.TRANSIENT not in outcomes.values():
+            self._acks.append((notification_id, datetime.now()))
+        else:
+            # في الدورة القادمة يُعاد الإرسال لمن فشل مؤقتاً فقط (وليس لمحادثة محظورة أو غير موجودة)
+            logger.warning(f"⏳ Notification {notification_id} kept pending after transient failures")
+            delivered = [user_id for user_id, outcome in outcomes.items() if outcome == self.SENT]
+            failed = [user_id for user_id, outcome in outcomes.items() if outcome == self.FAILED]
+            if delivered or failed:
+                self._deliveries.append((notification_id, delivered, failed))
+
+        if len(self._acks) + len(self._deliveries) >= self.ack_batch_size:
+            await self._flush_acks()
+
+    async def _flush_acks(self):
+        """حفظ التنبيهات المُرسلة والمستلمين في قاعدة البيانات دفعة واحدة دون حجب الحلقة
+
+        الدفعة التي يفشل حفظها تبقى في الطابور وتُعاد محاولتها في الحفظ التالي.
+        """
+        loop = asyncio.get_running_loop()
+
+        if self._deliveries:
+            batch, self._deliveries = self._deliveries, []
+            if not await loop.run_in_executor(None, self.db.record_notification_deliveries, batch):
+                logger.error(f"❌ Failed to record deliveries for {len(batch)} notifications, will retry")
+                self._deliveries = batch + self._deliveries
+
+        if self._acks:
+            batch, self._acks = self._acks, []
+            if not await loop.run_in_executor(None, self.db.mark_notifications_sent, batch):
+                logger.error(f"❌ Failed to mark {len(batch)} notifications as sent, will retry")
+                self._acks = batch + self._acks
+
+    async def _send_message(self, notification_id, user_id, message, semaphore):
+        """إرسال رسالة واحدة ضمن حد التوازي وحدود معدل تيليجرام"""
+        for attempt in range(self.max_retries + 1):
+            if self.rate_governor:
+                await self.rate_governor.acquire(user_id)
+
+            delay = 0
+            async with semaphore:
+                try:
+                    with SEND_SECONDS.time():
+                        await self.bot.send_message(
+                            chat_id=user_id,
+                            text=message,
+                            parse_mode='HTML'
+                        )
+                    if self.rate_governor:
+                        self.rate_governor.on_success()
+                    logger.info(f"✅ Sent notification {notification_id} to user {user_id}")
+                    MESSAGES.inc(outcome=self.SENT)
+                    return self.SENT
+                except RetryAfter as e:
+                    self._rate_limited += 1
+                    RATE_LIMITED.inc()
+                    retry_after = _seconds(e.retry_after)
+                    if self.rate_governor:
+                        self.rate_governor.on_flood(user_id, retry_after)
+                    else:
+                        delay = retry_after
+                    error = e
+                except (BadRequest, Forbidden) as e:
+                    # أخطاء دائمة (محادثة غير موجودة أو محظورة): لا فائدة من الإعادة
+                    logger.error(f"❌ Failed to send to user {user_id}: {e}")
+                    MESSAGES.inc(outcome=self.FAILED)
+                    return self.FAILED
+                except NetworkError as e:
+                    error = e
+                    delay = 2 ** attempt
+                except Exception as e:
+                    logger.error(f"❌ Failed to send to user {user_id}: {e}")
+                    MESSAGES.inc(outcome=self.FAILED)
+                    return self.FAILED
+
+            # الانتظار خارج الـ semaphore حتى لا تُحجز خانة توازي أثناء التراجع، ولا انتظار بعد آخر محاولة
+            if delay and attempt < self.max_retries:
+                await asyncio.sleep(delay)
+
+        logger.error(f"❌ Failed to send to user {user_id} after {self.max_retries} retries: {error}")
+        MESSAGES.inc(outcome=self.TRANSIENT)
+        return self.TRANSIENT
+
+
+def split_message(parts, limit=TELEGRAM_MESSAGE_LIMIT, separator=DIGEST_SEPARATOR):
+    """دمج الأجزاء في أقل عدد من الرسائل دون تجاوز الحد، مع عدم قطع أي جزء ما أمكن"""
+    return [chunk for chunk, _ in pack_message(parts, limit, separator)]
+
+
+def pack_message(parts, limit=TELEGRAM_MESSAGE_LIMIT, separator=DIGEST_SEPARATOR):
+    """مثل split_message مع أرقام الأجزاء في كل رسالة: [(نص الرسالة، [أرقام الأجزاء])، ...]"""
+    chunks = []
+    current = ''
+    indices = []
+    for index, part in enumerate(parts):
+        # جزء أطول من الحد بمفرده يُقطع قطعاً صريحاً
+        while len(part) > limit:
+            if current:
+                chunks.append((current, indices))
+                current, indices = '', []
+            chunks.append((part[:limit], [index]))
+            part = part[limit:]
+
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) <= limit:
+            current = candidate
+            indices = indices + [index]
+        else:
+            chunks.append((current, indices))
+            current, indices = part, [index]
+
+    if current:
+        chunks.append((current, indices))
+    return chunks
+
+
+def _seconds(retry_after):
+    """retry_after قد يكون رقماً أو timedelta حسب إصدار المكتبة"""
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
@@ -3,31 +3,92 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from flask import Flask, jsonify, request
-import psycopg2
 from telegram import Update, Bot
 from telegram.ext import Application, CommandHandler, ContextTypes
 import asyncio
+import functools
+import threading
 import nest_asyncio
 
+from background_loop import BackgroundEventLoop
+from config import DATABASE_URL, DB_POOL_TIMEOUT, MAIN_DB_POOL_MAX, MAIN_DB_POOL_MIN
+from db_pool import ConnectionPool
+from metrics import instrument_flask
+from update_queue import UpdateProcessor
+
 # السماح بـ nested event loops
 nest_asyncio.apply()
 
 app = Flask(__name__)
+instrument_flask(app, 'main')
 
 # متغيرات عامة
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 WEBHOOK_URL = 'https://notification-system-cm5l.onrender.com'
 bot_app = None
 
+# وضع الـ Webhook: queue = إضافة التحديث للطابور والرد فوراً، sync = المعالجة داخل الطلب
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'queue')
+WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', 32))
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', 1000))
+update_processor = None
+
+# مجمع اتصالات مشترك يُنشأ عند بدء التشغيل بدلاً من اتصال جديد لكل أمر
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def init_db_pool():
+    global db_pool
+    # طلبات Flask المتزامنة بعد فشل الإنشاء عند البدء لا تُنشئ أكثر من مجمع
+    with db_pool_lock:
+        if db_pool is not None:
+            return db_pool
+        try:
+            db_pool = ConnectionPool(
+                DATABASE_URL, minconn=MAIN_DB_POOL_MIN, maxconn=MAIN_DB_POOL_MAX,
+                timeout=DB_POOL_TIMEOUT
+            )
+            print(f"✅ Database pool ready ({MAIN_DB_POOL_MIN}-{MAIN_DB_POOL_MAX} connections)")
+            return db_pool
+        except Exception as e:
+            print(f"Database pool error: {e}")
+            return None
+
 # وظيفة الاتصال بقاعدة البيانات
 def get_db_connection():
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        return conn
+        if db_pool is None and not init_db_pool():
+            return None
+        return db_pool.getconn()
     except Exception as e:
         print(f"Database error: {e}")
         return None
 
+def release_db_connection(conn):
+    """إعادة الاتصال إلى المجمع"""
+    if conn is not None:
+        db_pool.putconn(conn)
+
+def query_db(query, params=None, fetchone=False):
+    """تنفيذ استعلام قراءة على اتصال من المجمع (None إذا تعذر الاتصال)"""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        result = cursor.fetchone() if fetchone else cursor.fetchall()
+        cursor.close()
+        return result
+    finally:
+        release_db_connection(conn)
+
+async def run_blocking(func, *args, **kwargs):
+    """تشغيل دالة متزامنة (مثل استعلام قاعدة البيانات) في executor حتى لا تحجب حلقة البوت"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
 # إنشاء الجداول
 def init_db():
     conn = get_db_connection()
@@ -50,11 +111,12 @@ def init_db():
         """)
         conn.commit()
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
         print("✅ Database tables created")
         return True
     except Exception as e:
         print(f"❌ Error creating tables: {e}")
+        release_db_connection(conn)
         return False
 
 # ═══════════════════════════════════════
@@ -74,14 +136,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def list_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض المعاملات"""
-    conn = get_db_connection()
-    if not conn:
-        await update.message.reply_text("❌ خطأ في الاتصال بقاعدة البيانات")
-        return
-    
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
+        rows = await run_blocking(query_db, """
             SELECT id, amount, description, due_date, status 
             FROM transactions 
             WHERE user_id = %s
@@ -89,9 +145,9 @@ async def list_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
             LIMIT 10
         """, (update.effective_user.id,))
         
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        if rows is None:
+            await update.message.reply_text("❌ خطأ في الاتصال بقاعدة البيانات")
+            return
         
         if not rows:
             await update.message.reply_text("📋 لا توجد معاملات مسجلة بعد")
@@ -112,22 +168,16 @@ async def list_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إحصائيات"""
-    conn = get_db_connection()
-    if not conn:
-        await update.message.reply_text("❌ خطأ في الاتصال")
-        return
-    
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
+        result = await run_blocking(query_db, """
             SELECT COUNT(*), COALESCE(SUM(amount), 0) 
             FROM transactions 
             WHERE user_id = %s AND status = 'active'
-        """, (update.effective_user.id,))
+        """, (update.effective_user.id,), fetchone=True)
         
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        if result is None:
+            await update.message.reply_text("❌ خطأ في الاتصال")
+            return
         
         count = result[0]
         total = float(result[1])
@@ -158,7 +208,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def init_bot():
     """إنشاء البوت"""
-    global bot_app
+    global bot_app, update_processor
     
     if not BOT_TOKEN:
         print("❌ BOT_TOKEN not found")
@@ -175,13 +225,26 @@ def init_bot():
         bot_app.add_handler(CommandHandler("stats", stats))
         bot_app.add_handler(CommandHandler("help", help_command))
         
+        # حلقة واحدة طويلة العمر تعالج جميع التحديثات
+        if WEBHOOK_MODE == 'queue':
+            update_processor = UpdateProcessor(
+                bot_app,
+                BackgroundEventLoop(name='telegram-updates'),
+                max_concurrency=WEBHOOK_CONCURRENCY,
+                max_pending=WEBHOOK_MAX_PENDING
+            )
+            update_processor.start()
+        
         print("✅ Bot initialized")
         
         # تفعيل الـ Webhook تلقائياً
         try:
-            loop = asyncio.get_event_loop()
             webhook_url = f"{WEBHOOK_URL}/webhook"
-            loop.run_until_complete(bot_app.bot.set_webhook(webhook_url))
+            if update_processor:
+                update_processor.run(bot_app.bot.set_webhook(webhook_url))
+            else:
+                loop = asyncio.get_event_loop()
+                loop.run_until_complete(bot_app.bot.set_webhook(webhook_url))
             print(f"✅ Webhook set to: {webhook_url}")
         except Exception as e:
             print(f"⚠️ Webhook setup warning: {e}")
@@ -223,13 +286,15 @@ def health():
             cursor.close()
         except:
             pass
-        conn.close()
+        release_db_connection(conn)
     
     return jsonify({
         "status": "ok",
         "database": db_status,
         "tables_ready": tables_exist,
-        "bot": "ready" if bot_app else "not ready"
+        "bot": "ready" if bot_app else "not ready",
+        "webhook_queue_depth": update_processor.metrics()['queue_depth'] if update_processor else None,
+        "db_pool": db_pool.stats() if db_pool else None
     })
 
 @app.route('/webhook', methods=['POST'])
@@ -241,6 +306,13 @@ def webhook():
     try:
         update = Update.de_json(request.get_json(force=True), bot_app.bot)
         
+        # إضافة التحديث للطابور والرد على تيليجرام فوراً
+        if update_processor:
+            if not update_processor.submit(update):
+                # الطابور ممتلئ: 503 يجعل تيليجرام يعيد المحاولة لاحقاً
+                return jsonify({"error": "Update queue is full"}), 503
+            return jsonify({"status": "queued"})
+        
         # معالجة الرسالة في event loop
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -252,21 +324,24 @@ def webhook():
         print(f"Webhook error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/webhook/metrics')
+def webhook_metrics():
+    """مقاييس طابور تحديثات تيليجرام"""
+    if not update_processor:
+        return jsonify({"mode": WEBHOOK_MODE, "queue": None})
+    return jsonify({"mode": WEBHOOK_MODE, "queue": update_processor.metrics()})
+
 @app.route('/transactions')
 def transactions():
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-    
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
+        rows = query_db("""
             SELECT id, user_id, amount, description, due_date, status, created_at 
             FROM transactions 
             ORDER BY created_at DESC 
             LIMIT 10
         """)
-        rows = cursor.fetchall()
+        if rows is None:
+            return jsonify({"error": "Database connection failed"}), 500
         
         transactions_list = []
         for row in rows:
@@ -280,9 +355,6 @@ def transactions():
                 "created_at": str(row[6])
             })
         
-        cursor.close()
-        conn.close()
-        
         return jsonify({
             "count": len(transactions_list),
             "transactions": transactions_list
@@ -297,6 +369,9 @@ def transactions():
 if __name__ == '__main__':
     print("🚀 Starting application...")
     
+    # إنشاء مجمع الاتصالات
+    init_db_pool()
+    
     # إنشاء الجداول
     if init_db():
         print("✅ Database initialized")
@@ -21,7 +21,9 @@ def list_tools():
                 'name': 'get_transactions',
                 'description': 'احصل على قائمة المعاملات',
                 'parameters': {
-                    'user_id': {'type': 'integer', 'optional': True}
+                    'user_id': {'type': 'integer', 'optional': True},
+                    'limit': {'type': 'integer', 'optional': True},
+                    'cursor': {'type': 'string', 'optional': True}
                 }
             },
             {
@@ -49,8 +51,15 @@ def execute_tool():
     params = data.get('parameters', {})
     
     if tool_name == 'get_transactions':
-        transactions = db.get_active_transactions(user_id=params.get('user_id'))
-        return jsonify({'success': True, 'result': transactions})
+        try:
+            transactions, next_cursor = db.get_active_transactions_page(
+                user_id=params.get('user_id'),
+                limit=params.get('limit'),
+                cursor=params.get('cursor')
+            )
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        return jsonify({'success': True, 'result': transactions, 'next_cursor': next_cursor})
     
     elif tool_name == 'add_transaction':
         trans_id = db.add_transaction(
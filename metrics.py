@@ -0,0 +1,258 @@
+"""
+مقاييس بصيغة Prometheus النصية (exposition format 0.0.4) بدون اعتماديات خارجية
+كل عملية (api / web_app / main) تعرض مقاييسها الخاصة عبر مسار /metrics عند تعيين METRICS_TOKEN
+(Authorization: Bearer <METRICS_TOKEN>)
+"""
+
+import hmac
+import math
+import threading
+import time
+
+from config import METRICS_TOKEN
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# حدود الـ histogram الافتراضية بالثواني
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    """عداد تراكمي لا ينقص"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """قيمة لحظية قابلة للزيادة والنقصان"""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """توزيع القيم على حدود ثابتة مع المجموع والعدد"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+
+    def time(self, **labels):
+        """مدير سياق لقياس زمن كتلة with"""
+        return _Timer(self, labels)
+
+    def _samples(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            le = _labels(self.labelnames, key, [('le', _number(bound))])
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_number(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    """مجموعة المقاييس المعروضة في /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """النص الكامل بصيغة Prometheus"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+def authorized(header, token=None):
+    """التحقق من ترويسة Authorization (Bearer) مقابل METRICS_TOKEN؛ بدون رمز لا يُسمح بشيء"""
+    token = METRICS_TOKEN if token is None else token
+    if not token or not header:
+        return False
+    return hmac.compare_digest(header.encode(), f"Bearer {token}".encode())
+
+
+def start_http_server(port, addr='0.0.0.0'):
+    """خادم HTTP مستقل في Thread يعرض /metrics (للعمليات التي لا تشغّل Flask)
+
+    يتطلب نفس الرمز عند تعيين METRICS_TOKEN، وإلا يعتمد على أن المنفذ داخلي فقط.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            if METRICS_TOKEN and not authorized(self.headers.get('Authorization')):
+                self.send_error(401)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+# ==================== Flask ====================
+
+HTTP_REQUEST_SECONDS = histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ('app', 'method', 'route', 'status')
+)
+
+
+def instrument_flask(app, app_name):
+    """قياس زمن كل طلب حسب المسار (قالب المسار وليس الرابط الفعلي)
+
+    مسار /metrics يُضاف فقط عند تعيين METRICS_TOKEN ويتطلب Authorization: Bearer <METRICS_TOKEN>،
+    لأن هذه الخدمات عامة والمقاييس تكشف المسارات وأسماء دوال قاعدة البيانات.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                app=app_name, method=request.method, route=route, status=response.status_code
+            )
+        return response
+
+    def metrics_view():
+        if not authorized(request.headers.get('Authorization')):
+            return Response('Unauthorized', status=401, headers={'WWW-Authenticate': 'Bearer'})
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    if METRICS_TOKEN and 'metrics' not in app.view_functions:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return app
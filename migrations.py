@@ -0,0 +1,280 @@
+"""
+ترحيل مخطط PostgreSQL: الأعمدة والدوال والـ triggers والفهارس المطلوبة للأداء
+
+يُشغَّل مرة واحدة عند النشر (python migrations.py) وليس عند بدء كل عملية. كل خطوة آمنة للتكرار،
+والفهارس تُبنى بـ CREATE INDEX CONCURRENTLY خارج أي معاملة فلا توقف الكتابة على الجداول.
+أي خطوة تفشل توقف الترحيل برسالة واضحة، ويكمل التشغيل التالي من حيث توقف.
+"""
+import logging
+import sys
+
+import psycopg2
+
+from arabic_text import NORMALIZE_ARABIC_FUNCTION_SQL, search_document_sql
+from config import DATABASE_URL, MIGRATION_BATCH_SIZE, MIGRATION_LOCK_TIMEOUT, STATISTICS_SHARDS
+from database_supabase import STATISTICS_COUNTERS, STATISTICS_TRIGGER_EVENTS, Database
+
+logger = logging.getLogger(__name__)
+
+
+def _create_trigger_sql(name, table, definition):
+    """إنشاء trigger إذا لم يكن موجوداً فقط
+
+    DROP/CREATE TRIGGER في كل تشغيل يأخذ قفل ACCESS EXCLUSIVE على الجدول ويوقف الكتابة،
+    وتعديل منطق الـ trigger يتم عبر CREATE OR REPLACE FUNCTION دون لمس الجدول.
+    """
+    return f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = '{name}' AND tgrelid = '{table}'::regclass
+            ) THEN
+                CREATE TRIGGER {name} {definition};
+            END IF;
+        END
+        $$
+    """
+
+
+# الأعمدة الجديدة (قيمة افتراضية ثابتة فقط، فالإضافة تعديل في الكتالوج دون إعادة كتابة الجدول)
+COLUMNS = [
+    # تاريخ إرسال التنبيه محسوب مسبقاً بدلاً من (end_date - days_before) وقت الاستعلام
+    "ALTER TABLE notifications ADD COLUMN IF NOT EXISTS fire_at DATE",
+    # المستلمون الذين استلموا التنبيه فعلاً، حتى لا يُعاد إرساله لهم بعد فشل مؤقت لغيرهم
+    "ALTER TABLE notifications ADD COLUMN IF NOT EXISTS delivered_to BIGINT[] NOT NULL DEFAULT '{}'",
+    # والمستلمون الذين فشل إرسالهم نهائياً (محادثة محظورة أو غير موجودة) فلا يُعاد لهم أيضاً
+    "ALTER TABLE notifications ADD COLUMN IF NOT EXISTS failed_to BIGINT[] NOT NULL DEFAULT '{}'",
+    # مفتاح منع التكرار للمعاملات الواردة من الأنظمة الخارجية (webhook)
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+]
+
+# ضمان fire_at في قاعدة البيانات نفسها لأي إدراج أو تعديل (وليس مسارات Python فقط)
+FIRE_AT_TRIGGERS = [
+    """
+        CREATE OR REPLACE FUNCTION notifications_set_fire_at() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NEW.fire_at IS NULL OR (
+                TG_OP = 'UPDATE'
+                AND (NEW.days_before, NEW.transaction_id) IS DISTINCT FROM (OLD.days_before, OLD.transaction_id)
+                AND NEW.fire_at IS NOT DISTINCT FROM OLD.fire_at
+            ) THEN
+                SELECT t.end_date - NEW.days_before INTO NEW.fire_at
+                FROM transactions t
+                WHERE t.transaction_id = NEW.transaction_id;
+            END IF;
+            RETURN NEW;
+        END;
+        $$
+    """,
+    _create_trigger_sql(
+        'notifications_fire_at', 'notifications',
+        "BEFORE INSERT OR UPDATE OF fire_at, days_before, transaction_id ON notifications "
+        "FOR EACH ROW EXECUTE FUNCTION notifications_set_fire_at()"
+    ),
+    """
+        CREATE OR REPLACE FUNCTION transactions_update_fire_at() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE notifications
+            SET fire_at = NEW.end_date - days_before
+            WHERE transaction_id = NEW.transaction_id
+            AND sent = false;
+            RETURN NULL;
+        END;
+        $$
+    """,
+    _create_trigger_sql(
+        'transactions_end_date_fire_at', 'transactions',
+        "AFTER UPDATE OF end_date ON transactions FOR EACH ROW "
+        "WHEN (OLD.end_date IS DISTINCT FROM NEW.end_date) "
+        "EXECUTE FUNCTION transactions_update_fire_at()"
+    ),
+]
+
+# (الاسم، UNIQUE، التعريف بعد اسم الفهرس)
+INDEXES = [
+    # فهرس جزئي على التنبيهات غير المرسلة فقط
+    ('idx_notifications_pending_fire_at', False, "ON notifications (fire_at) WHERE sent = false"),
+    # فهارس الترقيم بالمؤشر (keyset) على (end_date, transaction_id)
+    ('idx_transactions_active_keyset', False,
+     "ON transactions (end_date, transaction_id) WHERE is_active = true"),
+    ('idx_transactions_user_active_keyset', False,
+     "ON transactions (user_id, end_date, transaction_id) WHERE is_active = true"),
+    ('idx_transactions_idempotency_key', True,
+     "ON transactions (idempotency_key) WHERE idempotency_key IS NOT NULL"),
+    # آخر تعديل على المعاملات (إبطال الذاكرة المؤقتة في web_app)
+    ('idx_transactions_updated_at', False, "ON transactions (updated_at)"),
+]
+
+# البحث: دالة توحيد النص العربي وفهرس trigram على المستند الموحد
+SEARCH_INDEX = (
+    'idx_transactions_search_trgm', False,
+    f"ON transactions USING gin ({search_document_sql()} gin_trgm_ops)"
+)
+
+
+def _statistics_schema():
+    """جداول ودوال وtriggers العدادات التراكمية (على مستوى الجملة وليس الصف)"""
+    columns = [c for counters in STATISTICS_COUNTERS.values() for c in counters]
+    statements = [
+        f"""
+            CREATE TABLE IF NOT EXISTS statistics_counters (
+                id SMALLINT PRIMARY KEY,
+                {', '.join(f'{c} BIGINT NOT NULL DEFAULT 0' for c in columns)},
+                updated_at TIMESTAMPTZ DEFAULT NOW(),
+                reconciled_at TIMESTAMPTZ
+            )
+        """,
+        # الإصدار السابق كان صفاً واحداً (CHECK id = 1)
+        """
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_constraint WHERE conname = 'statistics_counters_id_check'
+                ) THEN
+                    ALTER TABLE statistics_counters DROP CONSTRAINT statistics_counters_id_check;
+                END IF;
+            END
+            $$
+        """,
+        f"""
+            INSERT INTO statistics_counters (id)
+            SELECT generate_series(1, {STATISTICS_SHARDS})
+            ON CONFLICT (id) DO NOTHING
+        """,
+    ]
+
+    for table, counters in STATISTICS_COUNTERS.items():
+        function = f"statistics_{table}_changed"
+        deltas = ', '.join(f"d_{c}" for c in counters)
+
+        def counts(rows, sign):
+            return ', '.join(
+                f"d_{c} {sign} COUNT(*) FILTER (WHERE {condition})" for c, condition in counters.items()
+            ) + f" INTO {deltas} FROM {rows}"
+
+        statements.append(f"""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                {' '.join(f'd_{c} BIGINT := 0;' for c in counters)}
+            BEGIN
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    SELECT {counts('new_rows', '+')};
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    SELECT {counts('old_rows', '-')};
+                END IF;
+                IF {' OR '.join(f'd_{c} <> 0' for c in counters)} THEN
+                    UPDATE statistics_counters
+                    SET {', '.join(f'{c} = {c} + d_{c}' for c in counters)}, updated_at = NOW()
+                    WHERE id = 1 + pg_backend_pid() % {STATISTICS_SHARDS};
+                    -- صف التوزيع غير موجود (لم يُضف بعد): الصف 1 دائماً موجود
+                    IF NOT FOUND THEN
+                        UPDATE statistics_counters
+                        SET {', '.join(f'{c} = {c} + d_{c}' for c in counters)}, updated_at = NOW()
+                        WHERE id = 1;
+                    END IF;
+                END IF;
+                RETURN NULL;
+            END;
+            $$
+        """)
+
+        for event, referencing in STATISTICS_TRIGGER_EVENTS:
+            statements.append(_create_trigger_sql(
+                f"statistics_{table}_{event.lower()}", table,
+                f"AFTER {event} ON {table} REFERENCING {referencing} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+            ))
+
+    return statements
+
+
+def _create_index_concurrently(cur, name, unique, definition):
+    """بناء فهرس دون قفل الكتابة؛ الفهرس غير الصالح من بناء سابق متوقف يُحذف ويُعاد بناؤه"""
+    cur.execute(
+        "SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(%s)", (name,)
+    )
+    row = cur.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        logger.warning(f"⚠️ Rebuilding invalid index {name}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    logger.info(f"🔨 Building index {name}...")
+    cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} {definition}")
+
+
+def _backfill_fire_at(cur, batch_size):
+    """ملء fire_at للتنبيهات التي سبقت الـ triggers على دفعات قصيرة حسب notification_id"""
+    cur.execute("SELECT COALESCE(MAX(notification_id), 0) FROM notifications WHERE fire_at IS NULL")
+    last_id = cur.fetchone()[0]
+    updated = 0
+    for start in range(0, last_id, batch_size):
+        cur.execute("""
+            UPDATE notifications n
+            SET fire_at = t.end_date - n.days_before
+            FROM transactions t
+            WHERE n.transaction_id = t.transaction_id
+            AND n.notification_id > %s AND n.notification_id <= %s
+            AND n.fire_at IS NULL
+        """, (start, start + batch_size))
+        updated += cur.rowcount
+    if updated:
+        logger.info(f"✅ Backfilled fire_at for {updated} notifications")
+
+
+def run_migrations(connection_string=None, batch_size=MIGRATION_BATCH_SIZE,
+                   lock_timeout=MIGRATION_LOCK_TIMEOUT):
+    """تطبيق كل خطوات الترحيل بالترتيب (كل جملة في معاملة قصيرة مستقلة)"""
+    connection_string = connection_string or DATABASE_URL
+    conn = psycopg2.connect(connection_string)
+    # CREATE INDEX CONCURRENTLY لا يعمل داخل معاملة
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            # جملة تنتظر قفلاً على جدول مشغول تفشل بدلاً من إيقاف الكتابات خلفها
+            cur.execute("SELECT set_config('lock_timeout', %s, false)", (lock_timeout,))
+
+            for statement in COLUMNS + FIRE_AT_TRIGGERS:
+                cur.execute(statement)
+            _backfill_fire_at(cur, batch_size)
+
+            for name, unique, definition in INDEXES:
+                _create_index_concurrently(cur, name, unique, definition)
+
+            # pg_trgm قد يتطلب صلاحيات غير متاحة: البحث يبقى على ILIKE
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ pg_trgm unavailable, indexed search stays disabled: {e}")
+            else:
+                cur.execute(NORMALIZE_ARABIC_FUNCTION_SQL)
+                _create_index_concurrently(cur, *SEARCH_INDEX)
+
+            for statement in _statistics_schema():
+                cur.execute(statement)
+    finally:
+        conn.close()
+
+    # حساب العدادات من الجداول بعد إنشاء الـ triggers
+    db = Database(connection_string, pool_max=0)
+    try:
+        if db.reconcile_statistics() is None:
+            raise RuntimeError('Failed to reconcile statistics counters')
+    finally:
+        db.close()
+    logger.info("✅ Database migrations applied")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        run_migrations(sys.argv[1] if len(sys.argv) > 1 else None)
+    except Exception as e:
+        logger.error(f"❌ Migration failed: {e}")
+        sys.exit(1)
@@ -1,17 +1,49 @@
 import logging
-import asyncio
+import time
 from datetime import datetime
 from telegram import Bot
+from telegram.request import HTTPXRequest
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from background_loop import BackgroundEventLoop
+from config import (
+    METRICS_PORT, NOTIFICATION_ACK_BATCH_SIZE, NOTIFICATION_CONCURRENCY, NOTIFICATION_DIGEST_MODE,
+    NOTIFICATION_MAX_RETRIES,
+    STATISTICS_RECONCILE_INTERVAL_HOURS,
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE
+)
+from dispatcher import NotificationDispatcher
+from metrics import gauge, start_http_server
+from rate_governor import RateGovernor
+
 logger = logging.getLogger(__name__)
 
+PENDING_NOTIFICATIONS = gauge('notification_pending', 'Pending notifications found by the last check')
+
 class NotificationSystem:
-    def __init__(self, database, bot_token):
+    def __init__(self, database, bot_token, concurrency=NOTIFICATION_CONCURRENCY,
+                 digest_mode=NOTIFICATION_DIGEST_MODE):
         self.db = database
         self.bot_token = bot_token
-        self.bot = Bot(token=bot_token)
+        # مجمع اتصالات HTTP بحجم حد التوازي حتى لا تنتظر الرسائل بعضها
+        self.bot = Bot(
+            token=bot_token,
+            request=HTTPXRequest(connection_pool_size=concurrency)
+        )
         self.scheduler = BackgroundScheduler()
+        self.event_loop = BackgroundEventLoop(name='notifications')
+        self.rate_governor = RateGovernor(
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            per_chat_rate=TELEGRAM_PER_CHAT_RATE
+        )
+        self.dispatcher = NotificationDispatcher(
+            self.bot, self.db, self.event_loop,
+            concurrency=concurrency,
+            rate_governor=self.rate_governor,
+            max_retries=NOTIFICATION_MAX_RETRIES,
+            ack_batch_size=NOTIFICATION_ACK_BATCH_SIZE,
+            digest_mode=digest_mode
+        )
         
     def check_and_send_notifications(self):
         """التحقق من التنبيهات المعلقة وإرسالها"""
@@ -20,6 +52,7 @@ class NotificationSystem:
             
             # استخدام get_pending_notifications بدلاً من get_due_notifications
             pending_notifications = self.db.get_pending_notifications()
+            PENDING_NOTIFICATIONS.set(len(pending_notifications))
             
             if not pending_notifications:
                 logger.info("✅ No pending notifications")
@@ -27,9 +60,8 @@ class NotificationSystem:
             
             logger.info(f"📬 Found {len(pending_notifications)} pending notifications")
             
-            # إرسال كل تنبيه
-            for notification in pending_notifications:
-                self.send_notification(notification)
+            # إرسال جميع التنبيهات بالتوازي على حلقة واحدة
+            return self.dispatcher.dispatch(pending_notifications)
                 
         except Exception as e:
             logger.error(f"❌ Error checking notifications: {e}")
@@ -37,26 +69,7 @@ class NotificationSystem:
     def send_notification(self, notification):
         """إرسال تنبيه واحد"""
         try:
-            notification_id = notification['notification_id']
-            message = notification['message']
-            recipients = notification['recipients']
-            
-            # إرسال لكل مستلم
-            for user_id in recipients:
-                try:
-                    # استخدام asyncio لإرسال الرسالة
-                    asyncio.run(self.bot.send_message(
-                        chat_id=user_id,
-                        text=message,
-                        parse_mode='HTML'
-                    ))
-                    logger.info(f"✅ Sent notification {notification_id} to user {user_id}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to send to user {user_id}: {e}")
-            
-            # تحديث حالة التنبيه
-            self.db.mark_notification_sent(notification_id)
-            
+            return self.dispatcher.dispatch([notification])
         except Exception as e:
             logger.error(f"❌ Error sending notification: {e}")
     
@@ -64,6 +77,8 @@ class NotificationSystem:
         """بدء نظام التنبيهات"""
         logger.info("🔔 Starting notification system...")
         
+        self.event_loop.start()
+        
         # إضافة مهمة التحقق من التنبيهات كل ساعة
         self.scheduler.add_job(
             self.check_and_send_notifications,
@@ -72,6 +87,20 @@ class NotificationSystem:
             id='check_notifications'
         )
         
+        # إعادة حساب العدادات التراكمية (قاعدة PostgreSQL فقط)
+        if hasattr(self.db, 'reconcile_statistics'):
+            self.scheduler.add_job(
+                self.db.reconcile_statistics,
+                'interval',
+                hours=STATISTICS_RECONCILE_INTERVAL_HOURS,
+                id='reconcile_statistics'
+            )
+        
+        # خادم /metrics مستقل إذا لم يعمل النظام داخل تطبيق Flask
+        if METRICS_PORT:
+            start_http_server(METRICS_PORT)
+            logger.info(f"📈 Metrics served on port {METRICS_PORT}")
+        
         # بدء الـ Scheduler
         self.scheduler.start()
         logger.info("✅ Notification scheduler started")
@@ -79,7 +108,8 @@ class NotificationSystem:
         # إبقاء الـ Thread يعمل
         try:
             while True:
-                asyncio.run(asyncio.sleep(60))
+                time.sleep(60)
         except (KeyboardInterrupt, SystemExit):
             self.scheduler.shutdown()
+            self.event_loop.stop()
             logger.info("🛑 Notification system stopped")
@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import date
+
+from config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+
+def encode_cursor(end_date, transaction_id):
+    """إنشاء مؤشر صفحة معتم من مفتاح الترتيب (end_date, transaction_id) - end_date قد يكون None"""
+    raw = json.dumps([None if end_date is None else str(end_date), transaction_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """فك مؤشر الصفحة إلى (date أو None، transaction_id) - يرفع ValueError إذا كان غير صالح"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        end_date, transaction_id = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(transaction_id, int) or isinstance(transaction_id, bool):
+            raise TypeError(transaction_id)
+        return (None if end_date is None else date.fromisoformat(end_date)), transaction_id
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def clamp_limit(limit):
+    """حجم الصفحة ضمن الحدود المسموحة"""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def build_page(rows, limit):
+    """rows مجلوبة بـ limit + 1: إرجاع (صفوف الصفحة، مؤشر الصفحة التالية أو None)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last['end_date'], last['transaction_id'])
@@ -0,0 +1,134 @@
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+# صفوف VALUES المتكررة (execute_values) بعد توحيد كل صف
+_REPEATED_ROWS = re.compile(r"(\((?:[^()]|\([^()]*\))*\))(?:\s*,\s*\1)+")
+
+
+def normalize_query(query):
+    """تحويل جملة SQL إلى قالب: القيم الحرفية والمعاملات تصبح ? والمسافات تُوحد"""
+    template = _STRING.sub('?', query)
+    template = _PLACEHOLDER.sub('?', template)
+    template = _NUMBER.sub('?', template)
+    template = _WHITESPACE.sub(' ', template).strip()
+    # قوائم IN (?, ?, ?) بأطوال مختلفة هي نفس القالب، وكذلك عدد صفوف VALUES
+    template = _VALUE_LIST.sub('(?, ...)', template)
+    return _REPEATED_ROWS.sub(r'\1, ...', template)
+
+
+def _short_text(text, limit=2000):
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _short(value, limit=500):
+    return _short_text(repr(value), limit)
+
+
+class QueryProfiler:
+    """إحصائيات زمن التنفيذ لكل قالب استعلام، سجل الاستعلامات البطيئة، وعينات EXPLAIN
+
+    EXPLAIN (ANALYZE, BUFFERS) يُنفذ الاستعلام فعلياً، لذا يُطبق على جمل SELECT فقط
+    وبحد أقصى مرة لكل قالب خلال explain_cooldown ثانية.
+    """
+
+    def __init__(self, slow_threshold_ms=200, explain_sample_rate=0.0, explain_cooldown=600):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_cooldown = explain_cooldown
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def record(self, query, params, elapsed_ms):
+        """تسجيل تنفيذ واحد - يرجع القالب إذا كان الاستعلام بطيئاً وإلا None"""
+        template = normalize_query(query)
+        slow = elapsed_ms >= self.slow_threshold_ms
+
+        with self._lock:
+            stats = self._templates.get(template)
+            if stats is None:
+                stats = self._templates[template] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow_count': 0,
+                    'last_explain_at': None, 'last_plan': None,
+                }
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            if slow:
+                stats['slow_count'] += 1
+
+        if slow:
+            logger.warning(
+                f"🐢 Slow query ({elapsed_ms:.1f} ms): {_short_text(_WHITESPACE.sub(' ', query).strip())} "
+                f"params={_short(params)}"
+            )
+            return template
+        return None
+
+    def should_explain(self, template):
+        """هل نأخذ عينة EXPLAIN لهذا القالب البطيء الآن؟"""
+        if not self.explain_sample_rate or not template.upper().startswith('SELECT'):
+            return False
+        if random.random() >= self.explain_sample_rate:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            stats = self._templates[template]
+            last = stats['last_explain_at']
+            if last is not None and now - last < self.explain_cooldown:
+                return False
+            stats['last_explain_at'] = now
+        return True
+
+    def explain(self, conn, template, query, params):
+        """تنفيذ EXPLAIN (ANALYZE, BUFFERS) وحفظ الخطة مع القالب"""
+        try:
+            with conn.cursor() as cur:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+            conn.rollback()
+        except Exception as e:
+            logger.error(f"خطأ في EXPLAIN للاستعلام البطيء: {e}")
+            if not conn.closed:
+                conn.rollback()
+            return None
+
+        with self._lock:
+            stats = self._templates.get(template)
+            if stats is not None:
+                stats['last_plan'] = plan
+        logger.warning(f"🔍 EXPLAIN for slow query template: {template}\n{plan}")
+        return plan
+
+    def report(self, limit=20, order_by='total_ms'):
+        """أعلى القوالب حسب order_by (total_ms / mean_ms / max_ms / count / slow_count)"""
+        with self._lock:
+            rows = [
+                {
+                    'template': template,
+                    'count': stats['count'],
+                    'total_ms': round(stats['total_ms'], 3),
+                    'mean_ms': round(stats['total_ms'] / stats['count'], 3),
+                    'max_ms': round(stats['max_ms'], 3),
+                    'slow_count': stats['slow_count'],
+                    'last_plan': stats['last_plan'],
+                }
+                for template, stats in self._templates.items()
+            ]
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        """حذف كل الإحصائيات"""
+        with self._lock:
+            self._templates.clear()
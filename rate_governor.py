@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """دلو رموز بسيط يعتمد على الحجز المسبق بدلاً من الانتظار الدوري"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        # updated قد يكون في المستقبل أثناء فترة الإيقاف (retry_after)
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self):
+        """حجز رمز وإرجاع عدد الثواني الواجب انتظارها قبل استخدامه"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = max(0.0, self.updated - now)
+        if self.tokens < 0:
+            wait += -self.tokens / self.rate
+        return wait
+
+    def pause(self, seconds):
+        """إيقاف الدلو لمدة محددة ثم الاستئناف من رصيد صفري"""
+        now = time.monotonic()
+        self._refill(now)
+        self.updated = max(self.updated, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def set_rate(self, rate):
+        """تغيير المعدل مع احتساب الرصيد المتراكم بالمعدل القديم"""
+        self._refill(time.monotonic())
+        self.rate = float(rate)
+
+    def is_idle(self):
+        """هل الدلو ممتلئ ولا توجد حجوزات معلقة"""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.updated <= now
+
+
+class RateGovernor:
+    """التحكم في معدل الإرسال لتيليجرام: حد عام وحد لكل محادثة مع تكيّف تلقائي مع أخطاء 429"""
+
+    def __init__(self, global_rate=30, per_chat_rate=1, min_global_rate=1,
+                 decrease_factor=0.5, increase_step=0.5, max_idle_chats=10000):
+        self.max_global_rate = float(global_rate)
+        self.min_global_rate = float(min_global_rate)
+        self.per_chat_rate = float(per_chat_rate)
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.max_idle_chats = max_idle_chats
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.flood_events = 0
+
+    @property
+    def global_rate(self):
+        return self.global_bucket.rate
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.max_idle_chats:
+                self._prune_chat_buckets()
+            bucket = TokenBucket(self.per_chat_rate, capacity=1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self):
+        """حذف دلاء المحادثات الخاملة حتى لا تنمو الذاكرة بلا حدود"""
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle()]:
+            del self.chat_buckets[chat_id]
+
+    async def acquire(self, chat_id):
+        """انتظار الإذن بإرسال رسالة واحدة إلى محادثة"""
+        # حد المحادثة أولاً حتى لا تُحجز رموز الحد العام أثناء انتظار محادثة مزدحمة
+        wait = self._chat_bucket(chat_id).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        wait = self.global_bucket.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """رفع المعدل العام تدريجياً حتى الحد الأقصى بعد كل إرسال ناجح"""
+        if self.global_bucket.rate < self.max_global_rate:
+            self.global_bucket.set_rate(
+                min(self.max_global_rate, self.global_bucket.rate + self.increase_step / self.global_bucket.rate)
+            )
+
+    def on_flood(self, chat_id, retry_after):
+        """تطبيق retry_after القادم من تيليجرام وخفض المعدل العام"""
+        self.flood_events += 1
+        self._chat_bucket(chat_id).pause(retry_after)
+        self.global_bucket.pause(retry_after)
+
+        new_rate = max(self.min_global_rate, self.global_bucket.rate * self.decrease_factor)
+        self.global_bucket.set_rate(new_rate)
+        logger.warning(
+            f"🐢 Flood control for chat {chat_id}: pausing {retry_after}s, "
+            f"global rate lowered to {new_rate:.1f} msg/s"
+        )
@@ -1,12 +1,25 @@
 """
 ملف اختبار شامل لـ API
 يمكنك تشغيله محلياً أو على Render
+
+الاستخدام:
+    python test_api.py                 # الاختبارات الوظيفية
+    python test_api.py load --clients 20 --duration 30 --mix list=5,get=3,create=1,stats=2,webhook=1
 """
 
 import requests
+import argparse
+import csv
+import io
 import json
+import random
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 
+from bench_report import percentile
+
 # ==================== الإعدادات ====================
 API_BASE_URL = "http://localhost:5001/api/v1"  # غيّره إلى رابط Render عند النشر
 # API_BASE_URL = "https://your-app.onrender.com/api/v1"  # استخدم هذا عند النشر
@@ -216,6 +229,116 @@ def test_15_unauthorized():
     print_result("Unauthorized Access", response)
     return response.status_code == 401
 
+def test_16_webhook_batch():
+    """اختبار 16: استقبال دفعة Webhook مع منع التكرار"""
+    print("\n📦 اختبار 16: استقبال دفعة معاملات (NDJSON) مرتين بنفس المفاتيح")
+    
+    run_id = uuid.uuid4().hex[:8]
+    end_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+    body = "\n".join(json.dumps({
+        "type": 1,
+        "user_id": 123456789,
+        "title": f"معاملة دفعة {i}",
+        "end_date": end_date,
+        "idempotency_key": f"batch-test-{run_id}-{i}"
+    }, ensure_ascii=False) for i in range(3))
+    
+    headers = dict(HEADERS, **{'Content-Type': 'application/x-ndjson'})
+    first = requests.post(f"{API_BASE_URL}/webhook/transactions/batch",
+                          headers=headers, data=body.encode())
+    print_result("Webhook Batch", first)
+    # إعادة نفس الدفعة لا تُنشئ معاملات جديدة
+    retry = requests.post(f"{API_BASE_URL}/webhook/transactions/batch",
+                          headers=headers, data=body.encode())
+    print_result("Webhook Batch Retry", retry)
+    return (first.status_code == 201 and first.json().get('created') == 3
+            and retry.status_code == 200 and retry.json().get('duplicates') == 3)
+
+def test_17_transactions_cursor():
+    """اختبار 17: الصفحة التالية عبر next_cursor تكمل الأولى دون تكرار"""
+    print("\n📄 اختبار 17: جلب صفحتين متتاليتين عبر cursor")
+    first = requests.get(f"{API_BASE_URL}/transactions", headers=HEADERS, params={"limit": 2})
+    print_result("Transactions Page 1", first)
+    if first.status_code != 200:
+        return False
+    page = first.json()
+    if page['next_cursor'] is None:
+        # معاملتان أو أقل: لا توجد صفحة تالية لاختبارها
+        return page['count'] <= 2
+    
+    second = requests.get(f"{API_BASE_URL}/transactions", headers=HEADERS,
+                          params={"limit": 2, "cursor": page['next_cursor']})
+    print_result("Transactions Page 2", second)
+    first_ids = {t['transaction_id'] for t in page['data']}
+    second_ids = {t['transaction_id'] for t in second.json().get('data', [])}
+    return (second.status_code == 200 and page['count'] == 2
+            and len(second_ids) > 0 and not first_ids & second_ids)
+
+def test_18_invalid_cursor():
+    """اختبار 18: مؤشر غير صالح يرجع 400"""
+    print("\n🚫 اختبار 18: جلب المعاملات بمؤشر غير صالح")
+    response = requests.get(f"{API_BASE_URL}/transactions", headers=HEADERS,
+                            params={"cursor": "not-a-cursor"})
+    print_result("Invalid Cursor", response)
+    return response.status_code == 400 and response.json().get('error') == 'Invalid cursor'
+
+def test_19_cursor_terminates():
+    """اختبار 19: تتبع next_cursor ينتهي بـ null دون تكرار أي معاملة"""
+    print("\n🔁 اختبار 19: المرور على كل الصفحات حتى نهايتها")
+    seen = set()
+    cursor = None
+    for _ in range(1000):
+        params = {"limit": 50}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{API_BASE_URL}/transactions", headers=HEADERS, params=params)
+        if response.status_code != 200:
+            print_result("Transactions Page", response)
+            return False
+        page = response.json()
+        ids = [t['transaction_id'] for t in page['data']]
+        if seen.intersection(ids):
+            print(f"❌ معاملات مكررة بين الصفحات: {sorted(seen.intersection(ids))}")
+            return False
+        seen.update(ids)
+        cursor = page['next_cursor']
+        if cursor is None:
+            print(f"✅ {len(seen)} معاملة")
+            return True
+    print("❌ next_cursor لم ينتهِ بعد 1000 صفحة")
+    return False
+
+def test_20_export_formats():
+    """اختبار 20: التصدير بصيغتي NDJSON و CSV - نوع المحتوى وصف لكل معاملة"""
+    print("\n📤 اختبار 20: تصدير المعاملات (NDJSON و CSV)")
+    ndjson_response = requests.get(f"{API_BASE_URL}/transactions/export", headers=HEADERS,
+                                   params={"format": "ndjson"})
+    csv_response = requests.get(f"{API_BASE_URL}/transactions/export", headers=HEADERS,
+                                params={"format": "csv"})
+    print(f"📊 NDJSON: {ndjson_response.status_code} {ndjson_response.headers.get('Content-Type')}")
+    print(f"📊 CSV: {csv_response.status_code} {csv_response.headers.get('Content-Type')}")
+    if ndjson_response.status_code != 200 or csv_response.status_code != 200:
+        return False
+    
+    # NDJSON: كائن JSON واحد في كل سطر وينتهي كل سطر بـ \n
+    body = ndjson_response.content.decode('utf-8')
+    records = [json.loads(line) for line in body.splitlines()]
+    ndjson_ok = (
+        ndjson_response.headers['Content-Type'].startswith('application/x-ndjson')
+        and (body == '' or body.endswith('\n'))
+        and all(isinstance(r, dict) and 'transaction_id' in r for r in records)
+    )
+    
+    # CSV: سطر عناوين واحد ثم صف لكل معاملة (الحقول متعددة الأسطر داخل علامات تنصيص)
+    rows = list(csv.DictReader(io.StringIO(csv_response.content.decode('utf-8'), newline='')))
+    csv_ok = (
+        csv_response.headers['Content-Type'].startswith('text/csv')
+        and len(rows) == len(records)
+        and [int(r['transaction_id']) for r in rows] == [r['transaction_id'] for r in records]
+    )
+    print(f"✅ {len(records)} سطر NDJSON، {len(rows)} صف CSV")
+    return ndjson_ok and csv_ok
+
 # ==================== تشغيل جميع الاختبارات ====================
 
 def run_all_tests():
@@ -239,7 +362,12 @@ def run_all_tests():
         test_12_ai_predict,
         test_13_delete_transaction,
         test_14_webhook,
-        test_15_unauthorized
+        test_15_unauthorized,
+        test_16_webhook_batch,
+        test_17_transactions_cursor,
+        test_18_invalid_cursor,
+        test_19_cursor_terminates,
+        test_20_export_formats
     ]
     
     results = []
@@ -273,7 +401,164 @@ def run_all_tests():
     print(f"📈 النتيجة: {passed}/{total} اختبار نجح ({(passed/total)*100:.1f}%)")
     print("="*60 + "\n")
 
+# ==================== اختبار الحمل ====================
+
+DEFAULT_MIX = "list=5,get=3,create=1,stats=2,webhook=1"
+DEFAULT_MAX_ERROR_RATE = 0.01
+
+def load_payload_end_date():
+    return (datetime.now() + timedelta(days=random.randint(1, 365))).strftime('%Y-%m-%d')
+
+def load_list(session, state):
+    return session.get(f"{API_BASE_URL}/transactions", params={"limit": 50})
+
+def load_get(session, state):
+    transaction_id = random.choice(state['transaction_ids']) if state['transaction_ids'] else 1
+    return session.get(f"{API_BASE_URL}/transactions/{transaction_id}")
+
+def load_create(session, state):
+    response = session.post(f"{API_BASE_URL}/transactions", json={
+        "transaction_type_id": random.randint(1, 5),
+        "user_id": 123456789,
+        "title": f"معاملة اختبار حمل {random.randint(1, 10**9)}",
+        "data": {"created_via": "load test"},
+        "end_date": load_payload_end_date()
+    })
+    if response.status_code == 201:
+        with state['lock']:
+            state['transaction_ids'].append(response.json().get('transaction_id'))
+    return response
+
+def load_stats(session, state):
+    return session.get(f"{API_BASE_URL}/stats")
+
+def load_webhook(session, state):
+    return session.post(f"{API_BASE_URL}/webhook/transaction", json={
+        "type": random.randint(1, 5),
+        "user_id": 123456789,
+        "title": f"معاملة Webhook اختبار حمل {random.randint(1, 10**9)}",
+        "metadata": {"source": "load_test"},
+        "end_date": load_payload_end_date()
+    })
+
+LOAD_ENDPOINTS = {
+    'list': load_list,
+    'get': load_get,
+    'create': load_create,
+    'stats': load_stats,
+    'webhook': load_webhook,
+}
+
+def parse_mix(mix):
+    """'list=5,get=3' -> {'list': 5, 'get': 3}"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in LOAD_ENDPOINTS:
+            raise ValueError(f"نوع طلب غير معروف: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+def run_load_test(clients=10, duration=30, mix=DEFAULT_MIX, max_p95=None, max_error_rate=DEFAULT_MAX_ERROR_RATE):
+    """تشغيل N عميل متزامن لمدة محددة وطباعة الإنتاجية وزمن الاستجابة لكل نقطة"""
+    weights = parse_mix(mix)
+    names = list(weights)
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    
+    # معرفات معاملات حقيقية لطلبات get
+    state = {'transaction_ids': [], 'lock': threading.Lock()}
+    try:
+        response = requests.get(f"{API_BASE_URL}/transactions", headers=HEADERS, params={"limit": 100})
+        state['transaction_ids'] = [t['transaction_id'] for t in response.json().get('data', [])]
+    except Exception as e:
+        print(f"⚠️ تعذر جلب معرفات المعاملات: {e}")
+    
+    def client():
+        # جلسة لكل عميل افتراضي لإعادة استخدام الاتصال (keep-alive)
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while not stop.is_set():
+            name = random.choices(names, weights=[weights[n] for n in names])[0]
+            started = time.perf_counter()
+            try:
+                response = LOAD_ENDPOINTS[name](session, state)
+                if response.status_code >= 400:
+                    local_errors[name] += 1
+            except Exception:
+                local_errors[name] += 1
+            local[name].append((time.perf_counter() - started) * 1000)
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+                errors[name] += local_errors[name]
+    
+    print(f"\n🚀 اختبار حمل: {clients} عميل لمدة {duration} ثانية ({mix})")
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    print("\n" + "="*60)
+    print("📊 نتائج اختبار الحمل")
+    print("="*60)
+    print(f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    
+    regressions = []
+    total = 0
+    for name in names:
+        samples = latencies[name]
+        total += len(samples)
+        if not samples:
+            print(f"{name:<10}{0:>10}{errors[name]:>8}")
+            continue
+        p95 = percentile(samples, 95)
+        print(f"{name:<10}{len(samples):>10}{errors[name]:>8}{len(samples) / elapsed:>9.1f}"
+              f"{percentile(samples, 50):>10.1f}{p95:>10.1f}{percentile(samples, 99):>10.1f}")
+        if max_p95 is not None and p95 > max_p95:
+            regressions.append(name)
+    
+    print("="*60)
+    print(f"📈 الإجمالي: {total} طلب، {total / elapsed:.1f} طلب/ثانية، "
+          f"{sum(errors.values())} خطأ")
+    
+    passed = True
+    if regressions:
+        print(f"❌ تجاوز p95 الحد ({max_p95} ms): {', '.join(regressions)}")
+        passed = False
+    
+    # طلبات تفشل بسرعة (401 / 500) تبدو ممتازة في p95، لذا نسبة الأخطاء جزء من البوابة
+    error_rate = sum(errors.values()) / total if total else 1.0
+    if error_rate > max_error_rate:
+        print(f"❌ نسبة الأخطاء {error_rate:.1%} تتجاوز الحد ({max_error_rate:.1%})")
+        passed = False
+    return passed
+
 # ==================== تشغيل ====================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="اختبارات API")
+    commands = parser.add_subparsers(dest="command")
+    load_parser = commands.add_parser("load", help="اختبار حمل بعملاء متزامنين")
+    load_parser.add_argument("--clients", type=int, default=10)
+    load_parser.add_argument("--duration", type=float, default=30, help="بالثواني")
+    load_parser.add_argument("--mix", default=DEFAULT_MIX, help="أوزان أنواع الطلبات")
+    load_parser.add_argument("--max-p95", type=float, help="فشل (exit 1) إذا تجاوز p95 لأي نقطة هذا الحد بالملي ثانية")
+    load_parser.add_argument("--max-error-rate", type=float, default=DEFAULT_MAX_ERROR_RATE,
+                             help="فشل (exit 1) إذا تجاوزت نسبة الطلبات الفاشلة هذا الحد (0.01 = 1%%)")
+    args = parser.parse_args()
+    
+    if args.command == "load":
+        passed = run_load_test(args.clients, args.duration, args.mix, args.max_p95, args.max_error_rate)
+        raise SystemExit(0 if passed else 1)
     run_all_tests()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateProcessor:
+    """طابور داخلي لتحديثات تيليجرام تعالجه حلقة asyncio واحدة طويلة العمر
+
+    تُعالج تحديثات المحادثات المختلفة بالتوازي، بينما تُعالج تحديثات
+    المحادثة الواحدة بترتيب وصولها.
+    """
+
+    def __init__(self, application, event_loop, max_concurrency=32, max_pending=1000):
+        self.application = application
+        self.event_loop = event_loop
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.queue = None
+        self._semaphore = None
+        self._tails = {}
+        self._lock = threading.Lock()
+        self._metrics = {
+            'received': 0,
+            'rejected': 0,
+            'processed': 0,
+            'failed': 0,
+            'pending': 0,
+            'in_flight': 0,
+            'max_pending': 0,
+            'latency_total': 0.0,
+        }
+
+    def start(self):
+        """تهيئة التطبيق وبدء مستهلك الطابور"""
+        self.event_loop.start()
+        self.event_loop.run(self._startup())
+        logger.info("📥 Update queue started")
+
+    async def _startup(self):
+        await self.application.initialize()
+        self.queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._consumer = asyncio.create_task(self._consume())
+
+    def run(self, coro, timeout=None):
+        """تنفيذ coroutine على حلقة المعالجة (مثل set_webhook)"""
+        return self.event_loop.run(coro, timeout)
+
+    def submit(self, update):
+        """إضافة تحديث إلى الطابور من Thread الخاص بـ Flask - يرجع False إذا امتلأ"""
+        with self._lock:
+            if self._metrics['pending'] >= self.max_pending:
+                self._metrics['rejected'] += 1
+                return False
+            self._metrics['received'] += 1
+            self._metrics['pending'] += 1
+            self._metrics['max_pending'] = max(self._metrics['max_pending'], self._metrics['pending'])
+
+        self.event_loop.loop.call_soon_threadsafe(self.queue.put_nowait, (update, time.monotonic()))
+        return True
+
+    async def _consume(self):
+        while True:
+            update, received_at = await self.queue.get()
+            chat = update.effective_chat
+            chat_id = chat.id if chat else None
+
+            # ربط التحديث بآخر تحديث لنفس المحادثة للحفاظ على الترتيب
+            previous = self._tails.get(chat_id) if chat_id is not None else None
+            task = asyncio.create_task(self._process(update, received_at, previous))
+
+            if chat_id is not None:
+                self._tails[chat_id] = task
+                task.add_done_callback(lambda t, c=chat_id: self._release_tail(c, t))
+
+    def _release_tail(self, chat_id, task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def _process(self, update, received_at, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+
+        async with self._semaphore:
+            self._count('in_flight', 1)
+            try:
+                await self.application.process_update(update)
+                self._count('processed', 1)
+            except Exception as e:
+                self._count('failed', 1)
+                logger.error(f"❌ Error processing update {update.update_id}: {e}")
+            finally:
+                self._count('in_flight', -1)
+                self._count('pending', -1)
+                self._count('latency_total', time.monotonic() - received_at)
+
+    def _count(self, key, amount):
+        with self._lock:
+            self._metrics[key] += amount
+
+    def metrics(self):
+        """مقاييس الطابور: العمق الحالي وعدد المعالَج والفاشل ومتوسط زمن المعالجة"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        latency_total = metrics.pop('latency_total')
+        done = metrics['processed'] + metrics['failed']
+        metrics['queue_depth'] = metrics['pending'] - metrics['in_flight']
+        metrics['avg_latency_ms'] = round(latency_total / done * 1000, 2) if done else 0.0
+        metrics['chats_in_progress'] = len(self._tails)
+        return metrics
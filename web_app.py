@@ -1,18 +1,91 @@
+import hashlib
 import os
-from flask import Flask, jsonify
+import threading
+import time
+from datetime import date, datetime, timezone
+from flask import Flask, Response, jsonify, request
 from database_supabase import Database
+from config import WEB_CACHE_TTL
+from metrics import instrument_flask
 
 app = Flask(__name__)
+instrument_flask(app, 'web_app')
 db = Database()
 
+# الصفحة و/api/stats تُبنى مرة لكل إصدار من بيانات المعاملات ولكل يوم (الأيام المتبقية)
+page_cache = {}
+page_locks = {}
+page_locks_guard = threading.Lock()
+
+def _page_lock(key):
+    with page_locks_guard:
+        return page_locks.setdefault(key, threading.Lock())
+
+def cached_payload(key, build):
+    """المحتوى المخزن لـ key
+    
+    خلال WEB_CACHE_TTL يُقدم دون أي استعلام ما لم تكتب هذه العملية على المعاملات؛ بعدها يُقارن
+    إصدار المعاملات (MAX(updated_at)) مرة واحدة ويُعاد البناء فقط إذا تغير أو تغير اليوم.
+    طلب واحد فقط يعيد البناء لكل key والبقية تنتظره.
+    """
+    entry = page_cache.get(key)
+    if _is_fresh(entry):
+        return entry
+    
+    with _page_lock(key):
+        # ربما أعاد طلب آخر البناء أثناء الانتظار
+        entry = page_cache.get(key)
+        if _is_fresh(entry):
+            return entry
+        
+        write_version = db.transactions_write_version
+        version = db.get_transactions_version()
+        today = date.today()
+        if (entry is None or version is None or entry['version'] != version
+                or entry['day'] != today or entry['write_version'] != write_version):
+            body = build()
+            etag = hashlib.sha1(body.encode()).hexdigest()
+            entry = {
+                'body': body,
+                'etag': etag,
+                # نفس المحتوى بعد إعادة البناء يحتفظ بوقته فتبقى نسخة المتصفح صالحة (304)
+                'last_modified': entry['last_modified'] if entry and entry['etag'] == etag
+                                 else datetime.now(timezone.utc).replace(microsecond=0),
+            }
+        else:
+            entry = dict(entry)
+        entry.update(version=version, day=today, write_version=write_version,
+                     checked_at=time.monotonic())
+        page_cache[key] = entry
+        return entry
+
+def _is_fresh(entry):
+    return (
+        entry is not None
+        and time.monotonic() - entry['checked_at'] < WEB_CACHE_TTL
+        and entry['write_version'] == db.transactions_write_version
+    )
+
+def conditional_response(entry, mimetype):
+    """استجابة مع ETag وLast-Modified ترجع 304 إذا كانت نسخة المتصفح حديثة"""
+    response = Response(entry['body'], mimetype=mimetype)
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    # يمكن للمتصفح التخزين لكن عليه التحقق في كل طلب
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'healthy', 'service': 'transactions-system'})
 
 @app.route('/')
 def index():
-    stats = db.get_stats()
-    transactions = db.get_active_transactions()
+    return conditional_response(cached_payload('index', render_index), 'text/html')
+
+def render_index():
+    stats = db.get_urgency_buckets()
+    transactions, _ = db.get_active_transactions_page(limit=10)
     
     html = f"""
 <!DOCTYPE html>
@@ -129,7 +202,7 @@ def index():
                 <div class="stat-label">🟡 تحذير</div>
             </div>
             <div class="stat">
-                <div class="stat-number">{stats['upcoming']}</div>
+                <div class="stat-number">{stats['safe']}</div>
                 <div class="stat-label">🟢 قادمة</div>
             </div>
         </div>
@@ -138,7 +211,7 @@ def index():
             <h2>📋 المعاملات النشطة</h2>
 """
     
-    for trans in transactions[:10]:
+    for trans in transactions:
         days = trans.get('days_left', 0)
         css_class = 'critical' if days <= 3 else 'warning' if days <= 7 else ''
         emoji = "🔴" if days <= 3 else "🟡" if days <= 7 else "🟢"
@@ -165,11 +238,24 @@ def index():
 
 @app.route('/api/stats')
 def api_stats():
-    return jsonify(db.get_stats())
+    entry = cached_payload('api_stats', lambda: app.json.dumps(db.get_urgency_buckets()))
+    return conditional_response(entry, 'application/json')
 
 @app.route('/api/transactions')
 def api_transactions():
-    return jsonify(db.get_active_transactions())
+    # مؤشر الصفحة التالية في ترويسة X-Next-Cursor للحفاظ على شكل الاستجابة (قائمة)
+    try:
+        transactions, next_cursor = db.get_active_transactions_page(
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    response = jsonify(transactions)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 def run_web():
     port = int(os.environ.get('PORT', 10000))  # ✅ يجب أن يكون هكذا